@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+
+"""
+Micro-benchmark for the stream copy loop.
+
+Compares the old fixed-size read loop with zotify.stream.ChunkedReader on an
+in-memory stream shaped like librespot's (read() overridden on io.BytesIO)
+and on a plain raw stream that implements readinto().
+
+    python3 benchmarks/stream_reader.py [size in MB]
+"""
+
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from zotify.stream import ChunkedReader  # noqa: E402
+
+CHUNK_SIZE = 20000
+
+
+class LibrespotLikeStream(io.BytesIO):
+    """ Overrides read() like librespot's AbsChunkedInputStream does """
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.data = memoryview(data)
+        self.pos = 0
+        self.allocations = 0
+
+    def read(self, size=-1) -> bytes:
+        chunk = bytes(self.data[self.pos:self.pos + size])
+        self.pos += len(chunk)
+        self.allocations += 1
+        return chunk
+
+
+class RawStream(io.RawIOBase):
+    """ Fills caller supplied buffers, read() allocates through the base class """
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.allocations = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self.data) - self.pos)
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+    def read(self, size=-1) -> bytes:
+        self.allocations += 1
+        return super().read(size)
+
+
+class NullSink:
+    def write(self, data) -> int:
+        return len(data)
+
+
+def old_loop(stream, total_size: int) -> None:
+    sink = NullSink()
+    b = 0
+    while b < 5:
+        data = stream.read(CHUNK_SIZE)
+        sink.write(data)
+        b += 1 if data == b'' else 0
+
+
+def new_loop(stream, total_size: int) -> None:
+    sink = NullSink()
+    for data in ChunkedReader(stream, total_size, CHUNK_SIZE):
+        sink.write(data)
+
+
+def run(name: str, loop, stream_class, data: bytes) -> None:
+    stream = stream_class(data)
+    start = time.perf_counter()
+    loop(stream, len(data))
+    elapsed = time.perf_counter() - start
+    megabytes = len(data) / (1024 * 1024)
+    print(f'{name:<10} {stream_class.__name__:<20} {megabytes / elapsed:>10.1f} MB/s '
+          f'{stream.allocations / megabytes:>10.1f} allocations/MB')
+
+
+def main() -> None:
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    data = bytes(size_mb * 1024 * 1024)
+    for stream_class in (LibrespotLikeStream, RawStream):
+        run('before', old_loop, stream_class, data)
+        run('after', new_loop, stream_class, data)
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,9 @@ def main():
     parser.add_argument('--password',
                         type=str,
                         help='Account password')
+    parser.add_argument('--plan',
+                        action='store_true',
+                        help='Lists what would be downloaded, merged and skipped, with an estimated size, without downloading anything.')
     group = parser.add_mutually_exclusive_group(required=False)
     group.add_argument('urls',
                        type=str,
@@ -51,6 +54,9 @@ def main():
     group.add_argument('-d', '--download',
                        type=str,
                        help='Downloads tracks, playlists and albums from the URLs written in the file passed.')
+    group.add_argument('--resume',
+                       action='store_true',
+                       help='Continues the last download that was interrupted, without fetching its collections again.')
 
     for configkey in CONFIG_VALUES:
         parser.add_argument(CONFIG_VALUES[configkey]['arg'],
@@ -61,6 +67,9 @@ def main():
     parser.set_defaults(func=client)
 
     args = parser.parse_args()
+    if args.plan and args.resume:
+        # --plan lists a new job, a resumed one downloads its journal as it was listed
+        parser.error('--plan can not be combined with --resume')
     args.func(args)
 
 
@@ -1,58 +1,67 @@
-from zotify.const import ITEMS, ARTISTS, NAME, ID
-from zotify.termoutput import Printer
-from zotify.track import download_track
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from zotify.const import ARTISTS, NAME, ID, TRACKS
+from zotify.jobs import WorkItem, TRACK_ITEM, run_job
+from zotify.pool import map_ordered
 from zotify.utils import fix_filename
 from zotify.zotify import Zotify
 
 ALBUM_URL = 'https://api.spotify.com/v1/albums'
 ARTIST_URL = 'https://api.spotify.com/v1/artists'
+# artists and albums expanded at the same time
+DISCOGRAPHY_FAN_OUT = 4
 
 
-def get_album_tracks(album_id):
-    """ Returns album tracklist """
-    songs = []
-    offset = 0
-    limit = 50
+def get_artist_albums(artist_id):
+    """ Returns artist's albums """
+    # all albums including singles an EPs
+    return [album[ID] for album in Zotify.invoke_url_paginated(f'{ARTIST_URL}/{artist_id}/albums', limit=50,
+                                                               include_groups='album,single')]
 
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return songs
+def get_album_items(album) -> Iterator[WorkItem]:
+    """ Yields the work items for every track of an album """
+    # the album object carries the first page of tracks along with its name
+    (raw, resp) = Zotify.invoke_url(f'{ALBUM_URL}/{album}')
+    artist, album_name = resp[ARTISTS][0][NAME], fix_filename(resp[NAME])
+    tracks = Zotify.invoke_url_paginated(f'{ALBUM_URL}/{album}/tracks', limit=50, first_page=resp[TRACKS])
+    for n, track in enumerate(tracks, start=1):
+        yield WorkItem(TRACK_ITEM, track[ID], 'album', extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album})
 
 
-def get_album_name(album_id):
-    """ Returns album name """
-    (raw, resp) = Zotify.invoke_url(f'{ALBUM_URL}/{album_id}')
-    return resp[ARTISTS][0][NAME], fix_filename(resp[NAME])
+def get_discography_items(artists) -> Iterator[WorkItem]:
+    """ Yields the work items for every album of the given artists
 
+    Artists and then albums are expanded DISCOGRAPHY_FAN_OUT at a time, and an
+    album listed by several artists, like a compilation or a collaboration, is
+    only included once.
+    """
+    seen = set()
+
+    def new_albums(albums):
+        for album_id in albums:
+            if album_id not in seen:
+                seen.add(album_id)
+                yield album_id
+
+    with ThreadPoolExecutor(max_workers=DISCOGRAPHY_FAN_OUT, thread_name_prefix='zotify-discography') as executor:
+        album_ids = (album_id for albums in map_ordered(executor, get_artist_albums, artists, DISCOGRAPHY_FAN_OUT)
+                     for album_id in new_albums(albums))
+        for items in map_ordered(executor, lambda album_id: list(get_album_items(album_id)), album_ids, DISCOGRAPHY_FAN_OUT):
+            yield from items
 
-def get_artist_albums(artist_id):
-    """ Returns artist's albums """
-    (raw, resp) = Zotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums?include_groups=album%2Csingle')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
-    # Recursive requests to get all albums including singles an EPs
-    while resp['next'] is not None:
-        (raw, resp) = Zotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
 
-    return album_ids
+def get_artist_items(artist) -> Iterator[WorkItem]:
+    """ Yields the work items for every album of an artist """
+    return get_discography_items([artist])
 
 
 def download_album(album):
     """ Downloads songs from an album """
-    artist, album_name = get_album_name(album)
-    tracks = get_album_tracks(album)
-    for n, track in Printer.progress(enumerate(tracks, start=1), unit_scale=True, unit='Song', total=len(tracks)):
-        download_track('album', track[ID], extra_keys={'album_num': str(n).zfill(2), 'artist': artist, 'album': album_name, 'album_id': album}, disable_progressbar=True)
+    run_job(f'album {album}', get_album_items(album), progress=True)
 
 
 def download_artist_albums(artist):
     """ Downloads albums of an artist """
-    albums = get_artist_albums(artist)
-    for album_id in albums:
-        download_album(album_id)
+    run_job(f'artist {artist}', get_artist_items(artist), progress=True)
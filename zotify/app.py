@@ -1,28 +1,31 @@
 from librespot.audio.decoders import AudioQuality
 from tabulate import tabulate
-from pathlib import Path, PurePath
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
 
-from zotify.album import download_album, download_artist_albums
+from zotify.album import download_album, download_artist_albums, get_album_items, get_artist_items, get_discography_items
 from zotify.const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
-    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE
+    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, ADDED_AT
+from zotify.jobs import WorkItem, TRACK_ITEM, EPISODE_ITEM, run_job, resume_job
 from zotify.loader import Loader
-from zotify.playlist import get_playlist_songs, get_playlist_info, download_from_user_playlist, download_playlist
-from zotify.podcast import download_episode, get_show_episodes
+from zotify.playlist import sync_playlist_items, download_from_user_playlist, download_playlist
+from zotify.podcast import get_show_episodes
 from zotify.termoutput import Printer, PrintChannel
-from zotify.track import download_track, get_saved_tracks, get_followed_artists, get_song_info
+from zotify.state import StateDB
+from zotify.track import get_saved_tracks, get_saved_tracks_since, get_followed_artists
+from zotify.transcode import TranscodePool
 from zotify.utils import splash, split_input, regex_input_for_urls
 from zotify.zotify import Zotify
 import os
 
 SEARCH_URL = 'https://api.spotify.com/v1/search'
-
-PLAYLIST_ROOT = 'A:/Songs'
-PLAYLIST_FOLDER = PurePath(Path.home() / Path('Music/Playlists'))
-Path(PLAYLIST_FOLDER).mkdir(exist_ok = True)
+# newest added_at of the liked songs seen by the last finished --liked run
+LIKED_WATERMARK = 'liked_added_at'
 
 def client(args) -> None:
     """ Connects to download server to perform query's and get songs to download """
     Zotify(args)
+    Zotify.DRY_RUN = getattr(args, 'plan', False)
 
     Printer.print(PrintChannel.SPLASH, splash())
 
@@ -34,6 +37,18 @@ def client(args) -> None:
     }
     Zotify.DOWNLOAD_QUALITY = quality_options[Zotify.CONFIG.get_download_quality()]
 
+    try:
+        download_from_args(args)
+    finally:
+        # let conversions still queued on the transcode pool finish
+        TranscodePool.join()
+
+def download_from_args(args) -> None:
+    """ Runs the download or search requested on the command line """
+    if getattr(args, 'resume', False):
+        resume_job()
+        return
+
     if args.download:
         urls = []
         filename = args.download
@@ -41,7 +56,7 @@ def client(args) -> None:
             with open(filename, 'r', encoding='utf-8') as file:
                 urls.extend([line.strip() for line in file.readlines()])
 
-            download_from_urls(urls)
+            download_from_urls(urls, command=f'--download {filename}')
 
         else:
             Printer.print(PrintChannel.ERRORS, f'File {filename} not found.\n')
@@ -57,16 +72,14 @@ def client(args) -> None:
         return
 
     if args.liked_songs:
-        for song in get_saved_tracks():
-            if not song[TRACK][NAME] or not song[TRACK][ID]:
-                Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-            else:
-                download_track('liked', song[TRACK][ID])
+        # with sync on, only songs saved since the last finished run are fetched
+        watermark = StateDB.get_watermark(LIKED_WATERMARK) if Zotify.CONFIG.get_sync() else None
+        watermarks = {}
+        run_job('--liked', get_liked_items(watermark, watermarks), watermarks=watermarks)
         return
     
     if args.followed_artists:
-        for artist in get_followed_artists():
-            download_artist_albums(artist)
+        run_job('--followed', get_discography_items(get_followed_artists()), progress=True)
         return
 
     if args.search:
@@ -86,64 +99,53 @@ def client(args) -> None:
             search_text = input('Enter search: ')
         search(search_text)
 
-def download_from_urls(urls: list[str]) -> bool:
-    """ Downloads from a list of urls """
-    download = False
+def get_liked_items(watermark: Optional[str], watermarks: Dict[str, str]) -> Iterator[WorkItem]:
+    """ Yields the liked songs to download, saved after watermark if given
+
+    The newest added_at seen is put in watermarks under LIKED_WATERMARK once
+    every page has been listed.
+    """
+    saved_tracks = get_saved_tracks_since(watermark) if watermark is not None else get_saved_tracks()
+    newest = watermark
+    count = 0
+    for song in saved_tracks:
+        count += 1
+        if song.get(ADDED_AT) and (newest is None or song[ADDED_AT] > newest):
+            newest = song[ADDED_AT]
+        if not song[TRACK][NAME] or not song[TRACK][ID]:
+            Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+        else:
+            yield WorkItem(TRACK_ITEM, song[TRACK][ID], 'liked')
 
+    if watermark is not None:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'{count} song(s) liked since last sync' + "\n")
+    if newest:
+        watermarks[LIKED_WATERMARK] = newest
+
+def get_url_items(urls: List[str], snapshots: Dict[str, str]) -> Iterator[WorkItem]:
+    """ Yields the tracks and episodes to download from a list of urls, and puts the snapshot ids of its playlists in snapshots """
     for spotify_url in urls:
         track_id, album_id, playlist_id, episode_id, show_id, artist_id = regex_input_for_urls(spotify_url)
 
         if track_id is not None:
-            download = True
-            download_track('single', track_id)
+            yield WorkItem(TRACK_ITEM, track_id)
         elif artist_id is not None:
-            download = True
-            download_artist_albums(artist_id)
+            yield from get_artist_items(artist_id)
         elif album_id is not None:
-            download = True
-            download_album(album_id)
+            yield from get_album_items(album_id)
         elif playlist_id is not None:
-            download = True
-            playlist_songs = get_playlist_songs(playlist_id)
-            name, _ = get_playlist_info(playlist_id)
-            enum = 1
-            char_num = len(str(len(playlist_songs)))
-            track_paths = []
-
-            for song in playlist_songs:
-                if not song[TRACK][NAME] or not song[TRACK][ID]:
-                    Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
-                else:
-                    if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
-                        download_episode(song[TRACK][ID])
-                    else:
-                        download_track('playlist', song[TRACK][ID], extra_keys=
-                        {
-                            'playlist_song_name': song[TRACK][NAME],
-                            'playlist': name,
-                            'playlist_num': str(enum).zfill(char_num),
-                            'playlist_id': playlist_id,
-                            'playlist_track_id': song[TRACK][ID]
-                        })
-
-                        (artists, raw_artists, album_name, song_name, image_url, release_year, disc_number,
-                            track_number, scraped_song_id, is_playable, duration_ms) = get_song_info(song[TRACK][ID])
-                        track_paths.append(f'{PLAYLIST_ROOT}/{artists[0]}/{album_name}/{song_name}.{Zotify.CONFIG.get_download_format()}')
-                    enum += 1
-            
-            with open('{}/{}.m3u'.format(PLAYLIST_FOLDER, name.replace('/', '')), "w", encoding="utf-8") as m3u_file:
-                m3u_file.write("#EXTM3U\n")  # Standard M3U header
-                for song in track_paths:
-                    m3u_file.write(f"{song}\n")
-
+            yield from sync_playlist_items(playlist_id, snapshots)
         elif episode_id is not None:
-            download = True
-            download_episode(episode_id)
+            yield WorkItem(EPISODE_ITEM, episode_id)
         elif show_id is not None:
-            download = True
-            for episode in get_show_episodes(show_id):
-                download_episode(episode)
+            yield from (WorkItem(EPISODE_ITEM, episode) for episode in get_show_episodes(show_id))
 
+def download_from_urls(urls: List[str], command=None) -> bool:
+    """ Downloads from a list of urls """
+    download = any(content_id is not None for spotify_url in urls for content_id in regex_input_for_urls(spotify_url))
+    if download:
+        snapshots = {}
+        run_job(command or ' '.join(urls), get_url_items(urls, snapshots), playlists=snapshots)
     return download
 
 def search(search_term):
@@ -316,7 +318,8 @@ def search(search_term):
                 print_pos = dics.index(dic) + 1
                 if print_pos == position:
                     if dic['type'] == TRACK:
-                        download_track('single', dic[ID])
+                        # through a job like a track url, so --plan and the journal cover it
+                        run_job(f'track {dic[ID]}', [WorkItem(TRACK_ITEM, dic[ID], label=dic[NAME])])
                     elif dic['type'] == ALBUM:
                         download_album(dic[ID])
                     elif dic['type'] == ARTIST:
@@ -0,0 +1,157 @@
+import atexit
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path, PurePath
+from typing import Dict, Iterable, List
+
+from zotify.const import ARTISTS, ARTISTS_URL, GENRES, ID
+from zotify.http_client import HttpClient
+from zotify.loader import Loader
+from zotify.termoutput import PrintChannel
+from zotify.zotify import Zotify
+
+# artist genres rarely change, refetch them after a month
+GENRE_CACHE_TTL = 30 * 24 * 60 * 60
+# covers kept in memory, enough for the albums being downloaded at once
+ARTWORK_MEMORY_ITEMS = 32
+
+
+def _write_json(path: PurePath, data) -> None:
+    """ Writes json to a temp file first so an interrupted run never leaves a broken cache """
+    temp_path = Path(f'{path}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    temp_path.replace(path)
+
+
+class GenreCache:
+    """ Artist genres cached in memory for the run and on disk across runs
+
+    Missing artists are fetched through the multi-id artists endpoint, 50 per
+    request, so tagging a library costs one request per 50 unique artists.
+    """
+    BATCH_SIZE = 50
+
+    _genres: Dict[str, list] = None
+    _dirty = False
+    _in_flight: Dict[str, threading.Event] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_path(cls) -> PurePath:
+        return PurePath(Zotify.CONFIG.get_cache_dir()).joinpath('genres.json')
+
+    @classmethod
+    def _load(cls) -> None:
+        genres = {}
+        if Path(cls.get_path()).exists():
+            try:
+                with open(cls.get_path(), 'r', encoding='utf-8') as file:
+                    genres = json.load(file)
+            except (OSError, ValueError):
+                genres = {}
+        now = time.time()
+        cls._genres = {artist_id: entry for artist_id, entry in genres.items() if now - entry[0] < GENRE_CACHE_TTL}
+        atexit.register(cls.save)
+
+    @classmethod
+    def get(cls, artist_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """ Returns the genres of every artist, fetching the ones that aren't cached yet
+
+        Requests run outside the lock. Artists another thread is already
+        fetching are waited for instead of being requested again.
+        """
+        artist_ids = [artist_id for artist_id in artist_ids if artist_id]
+        event = threading.Event()
+        with cls._lock:
+            if cls._genres is None:
+                cls._load()
+            waits = {cls._in_flight[artist_id] for artist_id in artist_ids if artist_id in cls._in_flight}
+            missing = list(dict.fromkeys(artist_id for artist_id in artist_ids
+                                         if artist_id not in cls._genres and artist_id not in cls._in_flight))
+            for artist_id in missing:
+                cls._in_flight[artist_id] = event
+
+        try:
+            for i in range(0, len(missing), cls.BATCH_SIZE):
+                cls._fetch(missing[i:i + cls.BATCH_SIZE])
+        finally:
+            with cls._lock:
+                for artist_id in missing:
+                    cls._in_flight.pop(artist_id, None)
+            event.set()
+
+        for wait in waits:
+            wait.wait()
+        with cls._lock:
+            return {artist_id: cls._genres[artist_id][1] for artist_id in artist_ids if artist_id in cls._genres}
+
+    @classmethod
+    def _fetch(cls, artist_ids: List[str]) -> None:
+        with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
+            (raw, resp) = Zotify.invoke_url(f'{ARTISTS_URL}?ids={",".join(artist_ids)}')
+        if ARTISTS not in resp:
+            raise ValueError(f'Invalid response from ARTISTS_URL:\n{raw}')
+
+        now = time.time()
+        with cls._lock:
+            for artist in resp[ARTISTS]:
+                if artist is not None:
+                    cls._genres[artist[ID]] = (now, artist[GENRES])
+            cls._dirty = True
+
+    @classmethod
+    def save(cls) -> None:
+        with cls._lock:
+            if cls._dirty:
+                _write_json(cls.get_path(), cls._genres)
+                cls._dirty = False
+
+
+class ArtworkCache:
+    """ Cover art keyed by image url, cached in memory and on disk
+
+    Covers are stored under the cache dir by the hash of their url, so every
+    track of an album, in any folder and any run, shares one download.
+    """
+    _images = OrderedDict()
+    _locks: Dict[str, threading.Lock] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, image_url: str) -> bytes:
+        key = hashlib.sha1(image_url.encode('utf-8')).hexdigest()
+        with cls._lock:
+            if key in cls._images:
+                cls._images.move_to_end(key)
+                return cls._images[key]
+            url_lock = cls._locks.setdefault(key, threading.Lock())
+
+        # only one thread downloads a given cover, the others wait for it
+        with url_lock:
+            with cls._lock:
+                if key in cls._images:
+                    return cls._images[key]
+
+            path = Path(Zotify.CONFIG.get_cache_dir()).joinpath('artwork', f'{key}.jpg')
+            if path.is_file():
+                image = path.read_bytes()
+            else:
+                response = HttpClient.get(image_url)
+                # an error page must never become the cover of every later track
+                response.raise_for_status()
+                image = response.content
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temp_path = Path(f'{path}.tmp')
+                temp_path.write_bytes(image)
+                temp_path.replace(path)
+
+            with cls._lock:
+                cls._images[key] = image
+                while len(cls._images) > ARTWORK_MEMORY_ITEMS:
+                    cls._images.popitem(last=False)
+                cls._locks.pop(key, None)
+        return image
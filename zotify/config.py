@@ -36,12 +36,26 @@ PRINT_WARNINGS = 'PRINT_WARNINGS'
 RETRY_ATTEMPTS = 'RETRY_ATTEMPTS'
 CONFIG_VERSION = 'CONFIG_VERSION'
 DOWNLOAD_LYRICS = 'DOWNLOAD_LYRICS'
+WORKERS = 'WORKERS'
+HTTP_POOL_SIZE = 'HTTP_POOL_SIZE'
+HTTP_CONNECT_TIMEOUT = 'HTTP_CONNECT_TIMEOUT'
+HTTP_READ_TIMEOUT = 'HTTP_READ_TIMEOUT'
+CACHE_DIR = 'CACHE_DIR'
+RESPONSE_CACHE = 'RESPONSE_CACHE'
+DUPLICATE_FILES = 'DUPLICATE_FILES'
+STATE_DB = 'STATE_DB'
+SYNC = 'SYNC'
+TRANSCODE_WORKERS = 'TRANSCODE_WORKERS'
+STREAM_TRANSCODE = 'STREAM_TRANSCODE'
 
 CONFIG_VALUES = {
     SAVE_CREDENTIALS:           { 'default': 'True',  'type': bool, 'arg': '--save-credentials'           },
     CREDENTIALS_LOCATION:       { 'default': '',      'type': str,  'arg': '--credentials-location'       },
     OUTPUT:                     { 'default': '',      'type': str,  'arg': '--output'                     },
     SONG_ARCHIVE:               { 'default': '',      'type': str,  'arg': '--song-archive'               },
+    CACHE_DIR:                  { 'default': '',      'type': str,  'arg': '--cache-dir'                  },
+    RESPONSE_CACHE:             { 'default': 'True',  'type': bool, 'arg': '--response-cache'             },
+    STATE_DB:                   { 'default': '',      'type': str,  'arg': '--state-db'                   },
     ROOT_PATH:                  { 'default': '',      'type': str,  'arg': '--root-path'                  },
     ROOT_PODCAST_PATH:          { 'default': '',      'type': str,  'arg': '--root-podcast-path'          },
     SPLIT_ALBUM_DISCS:          { 'default': 'False', 'type': bool, 'arg': '--split-album-discs'          },
@@ -52,12 +66,20 @@ CONFIG_VALUES = {
     DOWNLOAD_FORMAT:            { 'default': 'ogg',   'type': str,  'arg': '--download-format'            },
     DOWNLOAD_QUALITY:           { 'default': 'auto',  'type': str,  'arg': '--download-quality'           },
     TRANSCODE_BITRATE:          { 'default': 'auto',  'type': str,  'arg': '--transcode-bitrate'          },
+    TRANSCODE_WORKERS:          { 'default': '0',     'type': int,  'arg': '--transcode-workers'          },
+    STREAM_TRANSCODE:           { 'default': 'False', 'type': bool, 'arg': '--stream-transcode'           },
     SKIP_EXISTING:              { 'default': 'True',  'type': bool, 'arg': '--skip-existing'              },
     SKIP_PREVIOUSLY_DOWNLOADED: { 'default': 'False', 'type': bool, 'arg': '--skip-previously-downloaded' },
+    SYNC:                       { 'default': 'False', 'type': bool, 'arg': '--sync'                       },
+    DUPLICATE_FILES:            { 'default': 'hardlink', 'type': str,  'arg': '--duplicate-files'         },
     RETRY_ATTEMPTS:             { 'default': '1',     'type': int,  'arg': '--retry-attempts'             },
     BULK_WAIT_TIME:             { 'default': '1',     'type': int,  'arg': '--bulk-wait-time'             },
     OVERRIDE_AUTO_WAIT:         { 'default': 'False', 'type': bool, 'arg': '--override-auto-wait'         },
     CHUNK_SIZE:                 { 'default': '20000', 'type': int,  'arg': '--chunk-size'                 },
+    WORKERS:                    { 'default': '1',     'type': int,  'arg': '--workers'                    },
+    HTTP_POOL_SIZE:             { 'default': '10',    'type': int,  'arg': '--http-pool-size'             },
+    HTTP_CONNECT_TIMEOUT:       { 'default': '10',    'type': int,  'arg': '--http-connect-timeout'       },
+    HTTP_READ_TIMEOUT:          { 'default': '30',    'type': int,  'arg': '--http-read-timeout'          },
     DOWNLOAD_REAL_TIME:         { 'default': 'False', 'type': bool, 'arg': '--download-real-time'         },
     LANGUAGE:                   { 'default': 'en',    'type': str,  'arg': '--language'                   },
     PRINT_SPLASH:               { 'default': 'False', 'type': bool, 'arg': '--print-splash'               },
@@ -71,6 +93,9 @@ CONFIG_VALUES = {
     TEMP_DOWNLOAD_DIR:          { 'default': '',      'type': str,  'arg': '--temp-download-dir'          }
 }
 
+# how another path of an already downloaded track is created, see zotify.materialize
+DUPLICATE_FILES_MODES = ('hardlink', 'reflink', 'copy', 'download')
+
 OUTPUT_DEFAULT_PLAYLIST_EXT = '{artist}/{album}/{song_name}.{ext}'
 OUTPUT_DEFAULT_LIKED_SONGS = 'Liked Songs/{song_name}.{ext}'
 OUTPUT_DEFAULT_SINGLE = '{artist}/{album}/{song_name}.{ext}'
@@ -79,6 +104,7 @@ OUTPUT_DEFAULT_PLAYLIST = '{artist}/{album}/{song_name}.{ext}'
 
 class Config:
     Values = {}
+    Directory = None
 
     @classmethod
     def load(cls, args) -> None:
@@ -95,6 +121,7 @@ class Config:
             config_fp = args.config_location
 
         true_config_file_path = Path(config_fp).expanduser()
+        cls.Directory = PurePath(true_config_file_path).parent
 
         # Load config from zconfig.json
         Path(PurePath(true_config_file_path).parent).mkdir(parents=True, exist_ok=True)
@@ -123,6 +150,10 @@ class Config:
         if args.no_splash:
             cls.Values[PRINT_SPLASH] = False
 
+        if cls.Values[DUPLICATE_FILES] not in DUPLICATE_FILES_MODES:
+            raise ValueError(f'Unknown {DUPLICATE_FILES} "{cls.Values[DUPLICATE_FILES]}", '
+                             f'expected one of: {", ".join(DUPLICATE_FILES_MODES)}')
+
     @classmethod
     def get_default_json(cls) -> Any:
         r = {}
@@ -176,6 +207,18 @@ class Config:
     def get_skip_previously_downloaded(cls) -> bool:
         return cls.get(SKIP_PREVIOUSLY_DOWNLOADED)
 
+    @classmethod
+    def get_response_cache(cls) -> bool:
+        return cls.get(RESPONSE_CACHE)
+
+    @classmethod
+    def get_sync(cls) -> bool:
+        return cls.get(SYNC)
+
+    @classmethod
+    def get_duplicate_files(cls) -> str:
+        return cls.get(DUPLICATE_FILES)
+
     @classmethod
     def get_split_album_discs(cls) -> bool:
         return cls.get(SPLIT_ALBUM_DISCS)
@@ -184,6 +227,22 @@ class Config:
     def get_chunk_size(cls) -> int:
         return cls.get(CHUNK_SIZE)
 
+    @classmethod
+    def get_workers(cls) -> int:
+        return cls.get(WORKERS)
+
+    @classmethod
+    def get_http_pool_size(cls) -> int:
+        return cls.get(HTTP_POOL_SIZE)
+
+    @classmethod
+    def get_http_connect_timeout(cls) -> int:
+        return cls.get(HTTP_CONNECT_TIMEOUT)
+
+    @classmethod
+    def get_http_read_timeout(cls) -> int:
+        return cls.get(HTTP_READ_TIMEOUT)
+
     @classmethod
     def get_override_auto_wait(cls) -> bool:
         return cls.get(OVERRIDE_AUTO_WAIT)
@@ -216,6 +275,14 @@ class Config:
     def get_transcode_bitrate(cls) -> str:
         return cls.get(TRANSCODE_BITRATE)
 
+    @classmethod
+    def get_transcode_workers(cls) -> int:
+        return cls.get(TRANSCODE_WORKERS)
+
+    @classmethod
+    def get_stream_transcode(cls) -> bool:
+        return cls.get(STREAM_TRANSCODE)
+
     @classmethod
     def get_song_archive(cls) -> str:
         if cls.get(SONG_ARCHIVE) == '':
@@ -233,6 +300,32 @@ class Config:
         Path(song_archive.parent).mkdir(parents=True, exist_ok=True)
         return song_archive
 
+    @classmethod
+    def get_cache_dir(cls) -> str:
+        if cls.get(CACHE_DIR) == '':
+            system_paths = {
+                'win32': Path.home() / 'AppData/Local/Zotify/Cache',
+                'linux': Path.home() / '.cache/zotify',
+                'darwin': Path.home() / 'Library/Caches/Zotify'
+            }
+            if sys.platform not in system_paths:
+                cache_dir = PurePath(Path.cwd() / '.zotify/cache')
+            else:
+                cache_dir = PurePath(system_paths[sys.platform])
+        else:
+            cache_dir = PurePath(Path(cls.get(CACHE_DIR)).expanduser())
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        return cache_dir
+
+    @classmethod
+    def get_state_db(cls) -> str:
+        if cls.get(STATE_DB) == '':
+            state_db = PurePath(cls.Directory).joinpath('state.db')
+        else:
+            state_db = PurePath(Path(cls.get(STATE_DB)).expanduser())
+        Path(state_db.parent).mkdir(parents=True, exist_ok=True)
+        return state_db
+
     @classmethod
     def get_save_credentials(cls) -> bool:
         return cls.get(SAVE_CREDENTIALS)
@@ -6,6 +6,8 @@ TRACKS_URL = 'https://api.spotify.com/v1/tracks'
 
 TRACK_STATS_URL = 'https://api.spotify.com/v1/audio-features/'
 
+ARTISTS_URL = 'https://api.spotify.com/v1/artists'
+
 TRACKNUMBER = 'tracknumber'
 
 DISCNUMBER = 'discnumber'
@@ -50,6 +52,12 @@ LIMIT = 'limit'
 
 OFFSET = 'offset'
 
+TOTAL = 'total'
+
+ADDED_AT = 'added_at'
+
+SNAPSHOT_ID = 'snapshot_id'
+
 AUTHORIZATION = 'Authorization'
 
 IS_PLAYABLE = 'is_playable'
@@ -0,0 +1,176 @@
+import random
+import threading
+import time
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from zotify.config import Config
+
+# api.spotify.com, spclient, api-partner, the image cdn and podcast hosts
+POOL_HOSTS = 16
+
+
+class HttpClient:
+    """ Shared keep-alive HTTP client for every Web API, image and podcast request
+
+    All threads share one requests session, so connections to each host are
+    pooled and reused instead of paying a new TCP+TLS handshake per call.
+    """
+    _session: requests.Session = None
+    _adapter: HTTPAdapter = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        if cls._session is None:
+            with cls._lock:
+                if cls._session is None:
+                    # never hand out fewer connections than there are download workers
+                    pool_size = max(Config.get_http_pool_size(), Config.get_workers())
+                    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size)
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    session.headers['Accept-Encoding'] = 'gzip, deflate'
+                    cls._adapter = adapter
+                    cls._session = session
+        return cls._session
+
+    @classmethod
+    def get_timeout(cls):
+        return Config.get_http_connect_timeout(), Config.get_http_read_timeout()
+
+    @classmethod
+    def get(cls, url, **kwargs) -> requests.Response:
+        """ Same as requests.get, with pooled connections and default timeouts """
+        kwargs.setdefault('timeout', cls.get_timeout())
+        return cls.session().get(url, **kwargs)
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        """ Returns how many connections were opened and how many requests reused one """
+        opened = 0
+        requests_sent = 0
+        if cls._adapter is not None:
+            pools = cls._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    requests_sent += pool.num_requests
+        return {
+            'requests': requests_sent,
+            'connections_opened': opened,
+            'connections_reused': max(requests_sent - opened, 0),
+        }
+
+
+# 429s are retried this many times on top of RETRY_ATTEMPTS
+RATE_LIMIT_RETRIES = 10
+# exponential backoff for server and connection errors, in seconds
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+
+def backoff_delay(failures: int) -> float:
+    """ Exponential backoff with jitter, so retrying workers don't fire in lockstep """
+    return min(BACKOFF_BASE * 2 ** (failures - 1), BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def retry_after(response: requests.Response, throttled: int) -> float:
+    """ Seconds to wait after a 429, from its Retry-After header when present """
+    try:
+        return max(float(response.headers.get('Retry-After')), 0.0) + random.uniform(0.0, 0.5)
+    except (TypeError, ValueError):
+        return backoff_delay(throttled)
+
+
+class CircuitBreaker:
+    """ Process-wide pause for API requests
+
+    When one request gets rate limited the breaker trips and every thread
+    waits out the same Retry-After window before sending anything else.
+    """
+    _resume_at = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def trip(cls, seconds: float) -> None:
+        with cls._lock:
+            cls._resume_at = max(cls._resume_at, time.monotonic() + seconds)
+
+    @classmethod
+    def wait(cls) -> None:
+        remaining = cls._resume_at - time.monotonic()
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = cls._resume_at - time.monotonic()
+
+
+# requests that may go out back to back before pacing applies
+PACER_BURST = 5
+# responses slower than this are treated like a throttling signal
+SLOW_RESPONSE_TIME = 5.0
+# per healthy response the interval shrinks by this factor, per throttled one it doubles
+PACER_SPEEDUP = 0.9
+
+
+class Pacer:
+    """ Adaptive token bucket shared by API and content stream requests
+
+    The interval between requests shrinks while responses come back healthy
+    and doubles on every 429 or slow response. BULK_WAIT_TIME is the ceiling
+    for that interval, a value of 0 turns pacing off.
+    """
+    _interval = None
+    _tokens = PACER_BURST
+    _updated = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_ceiling(cls) -> float:
+        return float(Config.get_bulk_wait_time() or 0)
+
+    @classmethod
+    def acquire(cls) -> None:
+        """ Blocks until the next request may be sent """
+        ceiling = cls.get_ceiling()
+        if ceiling <= 0:
+            return
+
+        with cls._lock:
+            if cls._interval is None:
+                cls._interval = ceiling / 10
+            now = time.monotonic()
+            if cls._interval > 0:
+                cls._tokens = min(PACER_BURST, cls._tokens + (now - cls._updated) / cls._interval)
+            else:
+                cls._tokens = PACER_BURST
+            cls._updated = now
+
+            # tokens may go negative, which queues callers behind each other
+            cls._tokens -= 1
+            delay = -cls._tokens * cls._interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+    @classmethod
+    def record(cls, throttled: bool, elapsed: float) -> None:
+        """ Feeds a response back into the pacing rate """
+        ceiling = cls.get_ceiling()
+        if ceiling <= 0:
+            return
+
+        with cls._lock:
+            interval = cls._interval if cls._interval is not None else ceiling / 10
+            if throttled or elapsed > SLOW_RESPONSE_TIME:
+                interval = min(max(interval * 2, ceiling / 10), ceiling)
+            else:
+                interval *= PACER_SPEEDUP
+                # below a millisecond pacing is pointless
+                if interval < 0.001:
+                    interval = 0.0
+            cls._interval = interval
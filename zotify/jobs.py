@@ -0,0 +1,301 @@
+import threading
+import time
+import traceback
+from pathlib import Path, PurePath
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from zotify.podcast import download_episode
+from zotify.pool import DownloadPool, SHUTDOWN
+from zotify.state import StateDB, DONE, FAILED
+from zotify.termoutput import Printer, PrintChannel
+from zotify.transcode import TranscodePool
+from zotify.track import download_track, get_bitrate, get_output_path, get_output_template, get_song_info, SongInfoCache
+from zotify.track import FAILED as DOWNLOAD_FAILED
+from zotify.utils import fmt_bytes, get_directory_song_ids, get_previously_downloaded
+from zotify.zotify import Zotify
+
+PLAYLIST_ROOT = 'A:/Songs'
+PLAYLIST_FOLDER = PurePath(Path.home() / Path('Music/Playlists'))
+
+TRACK_ITEM = 'track'
+EPISODE_ITEM = 'episode'
+
+# items journaled and read back per batch
+JOURNAL_BATCH = 50
+# seconds before a partial batch is journaled anyway
+JOURNAL_FLUSH_TIME = 0.2
+
+
+class WorkItem(NamedTuple):
+    """ One track or episode of a job
+
+    mode picks the output template and extra_keys fill it in, like the
+    arguments of download_track. Tracks with a playlist are listed in that
+    playlist's M3U file once the job is done. Items carrying the result of an
+    earlier run are journaled as done and only show up in the M3U.
+    """
+    kind: str
+    content_id: str
+    mode: str = 'single'
+    extra_keys: Optional[dict] = None
+    label: Optional[str] = None
+    playlist: Optional[str] = None
+    result: Optional[dict] = None
+
+
+def run_job(command: str, items: Iterable[WorkItem], unit='Song', progress=False, playlists=None, watermarks=None) -> None:
+    """ Journals items as a new job and downloads them as they are listed
+
+    items is consumed on a background thread that appends it to the journal,
+    while this thread downloads whatever has been journaled so far. The first
+    download starts as soon as the first page of a collection arrives, and
+    the listed items wait in the journal instead of in memory.
+
+    Args:
+        command (str): Describes the job when it is resumed.
+        items (iterable): Work list, usually a generator expanding collections page by page.
+            An item that would download to the same file as an earlier one only reuses its result.
+        progress (bool, optional): Show one progress bar for the whole job instead of one per track.
+        playlists (dict, optional): Snapshot id of every playlist in items, read once items is exhausted
+            and recorded for --sync when the job finishes.
+        watermarks (dict, optional): Read once items is exhausted, recorded for --sync when every item is done.
+    """
+    if Zotify.DRY_RUN:
+        plan_job(command, items)
+        return
+
+    job_id = StateDB.create_job(command)
+    expander = threading.Thread(target=expand_job, args=(job_id, items, playlists, watermarks),
+                                name='zotify-expand', daemon=True)
+    expander.start()
+    run_journaled_job(job_id, unit, progress, expander)
+
+
+def get_plan_key(item: WorkItem) -> Optional[tuple]:
+    """ Returns what identifies the file an item downloads to, without fetching anything
+
+    Tracks are keyed by id and output template with the item's extra keys
+    filled in, the rest of the template only depends on the track. Items that
+    carry an earlier result are never merged.
+    """
+    if item.result is not None:
+        return None
+    if item.kind == EPISODE_ITEM:
+        return EPISODE_ITEM, item.content_id
+    return TRACK_ITEM, item.content_id, get_output_template(item.mode, item.extra_keys)
+
+
+def expand_job(job_id: int, items: Iterable[WorkItem], playlists=None, watermarks=None) -> None:
+    """ Appends items to the journal in batches, then marks the job's work list complete
+
+    An item that downloads to the same file as an earlier one, like a track
+    reached through both its artist and a playlist, is journaled as a
+    duplicate of the first and never downloaded itself.
+    """
+    seq = 0
+    batch = []
+    planned: Dict[tuple, int] = {}
+    flushed_at = time.monotonic()
+    try:
+        for item in items:
+            if SHUTDOWN.is_set():
+                return
+            entry = item._asdict()
+            key = get_plan_key(item)
+            if key in planned:
+                entry['duplicate_of'] = planned[key]
+            elif key is not None:
+                planned[key] = seq + len(batch)
+            batch.append(entry)
+            if len(batch) >= JOURNAL_BATCH or time.monotonic() - flushed_at > JOURNAL_FLUSH_TIME:
+                StateDB.add_job_items(job_id, seq, batch)
+                seq += len(batch)
+                batch = []
+                flushed_at = time.monotonic()
+        StateDB.add_job_items(job_id, seq, batch)
+        StateDB.set_job_expanded(job_id, playlists, watermarks)
+    except Exception as e:
+        # whatever was listed still downloads, the job stays unfinished
+        StateDB.add_job_items(job_id, seq, batch)
+        Printer.print(PrintChannel.ERRORS, '###   ERROR: FAILED TO LIST EVERYTHING TO DOWNLOAD   ###')
+        Printer.print(PrintChannel.ERRORS, str(e) + "\n")
+        Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+
+
+def resume_job() -> bool:
+    """ Continues the most recent job that didn't finish, returns False if there is none """
+    job = StateDB.get_unfinished_job()
+    if job is None:
+        Printer.print(PrintChannel.WARNINGS, '###   NO INTERRUPTED DOWNLOAD TO RESUME   ###\n')
+        return False
+
+    job_id, command, expanded = job
+    Printer.print(PrintChannel.PROGRESS_INFO, f'Resuming "{command}", '
+                  f'{StateDB.count_job_items(job_id, DONE)} of {StateDB.count_job_items(job_id)} items already done\n')
+    if not expanded:
+        Printer.print(PrintChannel.WARNINGS, f'###   WARNING: "{command}" WAS INTERRUPTED WHILE LISTING ITEMS, '
+                      'RUN IT AGAIN TO GET THE ONES AFTER THEM   ###\n')
+    run_journaled_job(job_id)
+    if not expanded and not SHUTDOWN.is_set():
+        write_playlists(job_id)
+        StateDB.finish_job(job_id)
+    return True
+
+
+def run_journaled_job(job_id: int, unit='Song', progress=False, expander: Optional[threading.Thread] = None) -> None:
+    """ Downloads the pending items of a job, following the journal while expander is still adding to it """
+    seq = 0
+    submitted = 0
+    with DownloadPool(unit=unit, progress=progress) as pool:
+        while True:
+            # checked before reading, so the last batch the expander wrote is never missed
+            expanding = expander is not None and expander.is_alive()
+            items = StateDB.get_job_items(job_id, start=seq, limit=JOURNAL_BATCH)
+            if not items:
+                if not expanding:
+                    break
+                expander.join(JOURNAL_FLUSH_TIME)
+                continue
+            seq = items[-1]['seq'] + 1
+
+            # done tracks are downloaded again if their file has gone missing since
+            pending = [item for item in items if item['duplicate_of'] is None and (item['state'] != DONE or
+                       (item['kind'] == TRACK_ITEM and item['path'] is not None and not Path(item['path']).exists()))]
+            SongInfoCache.queue([item['content_id'] for item in pending if item['kind'] == TRACK_ITEM])
+            for item in pending:
+                pool.submit(download_item, job_id, item, progress or pool.parallel, label=item['label'])
+            submitted += len(pending)
+            if not expanding:
+                pool.set_total(submitted)
+
+    # ids of items skipped or cut short by a shutdown were never looked up
+    SongInfoCache.clear()
+    # items are only recorded as done once their conversion finished
+    TranscodePool.join()
+    StateDB.resolve_duplicates(job_id)
+    if SHUTDOWN.is_set() or not StateDB.is_job_expanded(job_id):
+        return
+    write_playlists(job_id)
+    StateDB.finish_job(job_id)
+
+
+def download_item(job_id: int, item: Dict[str, Any], disable_progressbar=False):
+    """ Downloads one journaled item and records how it went """
+    if item['kind'] == EPISODE_ITEM:
+        saved = False
+        try:
+            saved = download_episode(item['content_id'], disable_progressbar=disable_progressbar)
+        finally:
+            # a failed episode stays pending for --resume
+            StateDB.set_item_state(job_id, item['seq'], DONE if saved else FAILED)
+        return None
+
+    def record(result):
+        # only called once the file is converted and in place, or the track failed or was skipped
+        StateDB.set_item_state(job_id, item['seq'], FAILED if result.status == DOWNLOAD_FAILED else DONE,
+                               str(result.path) if result.path is not None else None,
+                               result.artist, result.name, result.duration_ms)
+
+    return download_track(item['mode'], item['content_id'], extra_keys=item['extra_keys'],
+                          disable_progressbar=disable_progressbar, on_finished=record)
+
+
+def m3u_track_path(path) -> str:
+    """ Returns the M3U entry for a downloaded file, relative to PLAYLIST_ROOT """
+    try:
+        return f'{PLAYLIST_ROOT}/{PurePath(path).relative_to(Zotify.CONFIG.get_root_path()).as_posix()}'
+    except ValueError:
+        # output template points outside the root path
+        return str(path)
+
+
+def write_playlists(job_id: int) -> None:
+    """ Writes an M3U file for every playlist in a job, listing its tracks in order """
+    playlists = {}
+    for item in StateDB.get_job_items(job_id, in_playlist=True):
+        if item['playlist'] is not None:
+            playlists.setdefault(item['playlist'], []).append(item)
+
+    if playlists:
+        Path(PLAYLIST_FOLDER).mkdir(parents=True, exist_ok=True)
+    for name, tracks in playlists.items():
+        with open('{}/{}.m3u'.format(PLAYLIST_FOLDER, name.replace('/', '')), "w", encoding="utf-8") as m3u_file:
+            m3u_file.write("#EXTM3U\n")  # Standard M3U header
+            for track in tracks:
+                if track['path'] is None:
+                    continue
+                m3u_file.write(f"#EXTINF:{track['duration_ms'] // 1000},{track['artist']} - {track['name']}\n")
+                m3u_file.write(f"{m3u_track_path(track['path'])}\n")
+
+
+def plan_job(command: str, items: Iterable[WorkItem]) -> None:
+    """ Prints what a job would download, skip and merge without downloading anything (--plan)
+
+    Collections are expanded as for a real run and tracks are looked up 50 at
+    a time to find their output paths, no audio is fetched. The size is
+    estimated from each track's duration and the download bitrate.
+    """
+    bitrate = int(get_bitrate().rstrip('k')) * 1000
+    listed = duplicates = synced = episodes = 0
+    downloads = existing = archived = unavailable = failed = 0
+    estimated_bytes = 0
+    planned = set()
+    planned_paths = set()
+    batch = []
+
+    def resolve(tracks):
+        nonlocal duplicates, downloads, existing, archived, unavailable, failed, estimated_bytes
+        SongInfoCache.queue(track_id for track_id, output_template in tracks)
+        for track_id, output_template in tracks:
+            try:
+                (artists, raw_artists, album_name, name, image_url, release_year, disc_number,
+                 track_number, scraped_song_id, is_playable, duration_ms) = get_song_info(track_id)
+            except ValueError:
+                failed += 1
+                continue
+            filename = get_output_path(output_template, track_id, artists, album_name, name, release_year,
+                                       disc_number, track_number, scraped_song_id)
+            # different templates can still resolve to the same file
+            if filename in planned_paths:
+                duplicates += 1
+                continue
+            planned_paths.add(filename)
+            if not is_playable:
+                unavailable += 1
+            elif Zotify.CONFIG.get_skip_existing() and Path(filename).is_file() and \
+                    scraped_song_id in get_directory_song_ids(PurePath(filename).parent):
+                existing += 1
+            elif Zotify.CONFIG.get_skip_previously_downloaded() and scraped_song_id in get_previously_downloaded():
+                archived += 1
+            else:
+                downloads += 1
+                estimated_bytes += duration_ms / 1000 * bitrate / 8
+
+    for item in items:
+        listed += 1
+        key = get_plan_key(item)
+        if key is None:
+            synced += 1
+        elif key in planned:
+            duplicates += 1
+        elif item.kind == EPISODE_ITEM:
+            planned.add(key)
+            episodes += 1
+        else:
+            planned.add(key)
+            batch.append((item.content_id, key[2]))
+            if len(batch) >= SongInfoCache.BATCH_SIZE:
+                resolve(batch)
+                batch = []
+    resolve(batch)
+
+    Printer.print(PrintChannel.PROGRESS_INFO, f'Plan for "{command}":')
+    Printer.print(PrintChannel.PROGRESS_INFO, f'  {listed} item(s) listed, {duplicates} duplicate(s) merged')
+    Printer.print(PrintChannel.PROGRESS_INFO, f'  {downloads} track(s) to download, about {fmt_bytes(estimated_bytes)}')
+    if episodes:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'  {episodes} episode(s) to download, not included in the size')
+    Printer.print(PrintChannel.PROGRESS_INFO, f'  skipping {existing} already existing, {archived} downloaded before, '
+                  f'{unavailable} unavailable, {synced} unchanged since last sync')
+    if failed:
+        Printer.print(PrintChannel.PROGRESS_INFO, f'  {failed} track(s) whose information could not be fetched')
+    Printer.print(PrintChannel.PROGRESS_INFO, '')
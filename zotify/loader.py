@@ -4,7 +4,7 @@
 # imports
 from itertools import cycle
 from shutil import get_terminal_size
-from threading import Thread
+from threading import Thread, current_thread, main_thread
 from time import sleep
 
 from zotify.termoutput import Printer
@@ -32,6 +32,9 @@ class Loader:
         self.end = end
         self.timeout = timeout
         self.channel = chan
+        # spinners from download workers would garble each other, so only the
+        # main thread animates
+        self.quiet = current_thread() is not main_thread()
 
         self._thread = Thread(target=self._animate, daemon=True)
         if mode == 'std1':
@@ -46,7 +49,8 @@ class Loader:
         self.done = False
 
     def start(self):
-        self._thread.start()
+        if not self.quiet:
+            self._thread.start()
         return self
 
     def _animate(self):
@@ -61,6 +65,8 @@ class Loader:
 
     def stop(self):
         self.done = True
+        if self.quiet:
+            return
         cols = get_terminal_size((80, 20)).columns
         Printer.print_loader(self.channel, "\r" + " " * cols)
 
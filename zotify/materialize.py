@@ -0,0 +1,126 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from zotify.pool import SHUTDOWN
+from zotify.state import StateDB
+
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+COPY = 'copy'
+# never reuse a file, download every path on its own
+DOWNLOAD = 'download'
+
+# linux ioctl that makes dst share src's extents on btrfs, xfs and other cow filesystems
+FICLONE = 0x40049409
+# bytes per copy_file_range call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def reflink(source, target) -> None:
+    """ Clones source into target without copying data, raises OSError where the filesystem can't """
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            Path(target).unlink(missing_ok=True)
+            raise
+
+
+def copy_file(source, target) -> None:
+    """ Copies source to target, in the kernel with copy_file_range where available """
+    if not hasattr(os, 'copy_file_range'):
+        shutil.copyfile(source, target)
+        return
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        try:
+            while os.copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK_SIZE):
+                pass
+        except OSError:
+            # unsupported between these filesystems, start over in user space
+            src.seek(0)
+            dst.seek(0)
+            dst.truncate()
+            shutil.copyfileobj(src, dst)
+
+
+def materialize_file(source, target, mode: str) -> str:
+    """ Creates target with the same content as source, returns how it was done
+
+    A hardlink is tried first in hardlink mode, then a reflink, then a copy.
+    Tags only depend on the track, never on the path, so every file of a
+    track can share the same bytes and nothing needs retagging.
+    Copies and reflinks are written next to target and renamed into place.
+    """
+    if mode == HARDLINK:
+        try:
+            os.link(source, target)
+            return HARDLINK
+        except OSError:
+            pass
+
+    temp = Path(f'{target}.tmp')
+    if mode in (HARDLINK, REFLINK):
+        try:
+            reflink(source, temp)
+            temp.replace(target)
+            return REFLINK
+        except OSError:
+            pass
+
+    try:
+        copy_file(source, temp)
+        temp.replace(target)
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+    return COPY
+
+
+class TrackFiles:
+    """ Finished files of each track by format and quality, so another path of the same track reuses one
+
+    Finished files are kept in the files table of the state database across
+    runs. A file this run is still downloading or converting has a writer,
+    and another path of the same track waits for it instead of downloading
+    the track a second time.
+    """
+    _writing: Dict[Tuple[str, str], threading.Event] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def find_or_write(cls, track_id: str, variant: str, target) -> Optional[str]:
+        """ Returns a finished file to materialize target from, or None after making the caller its writer
+
+        A writer must call done once its file is finished or has failed.
+        """
+        key = (track_id, variant)
+        while True:
+            source = StateDB.get_file(track_id, variant, exclude=str(target))
+            if source is not None:
+                return source
+            with cls._lock:
+                event = cls._writing.get(key)
+                if event is None:
+                    cls._writing[key] = threading.Event()
+                    return None
+            while not event.wait(0.5):
+                if SHUTDOWN.is_set():
+                    raise KeyboardInterrupt
+
+    @classmethod
+    def done(cls, track_id: str, variant: str) -> None:
+        with cls._lock:
+            event = cls._writing.pop((track_id, variant), None)
+        if event is not None:
+            event.set()
@@ -1,61 +1,102 @@
-from zotify.const import ITEMS, ID, TRACK, NAME
-from zotify.termoutput import Printer
-from zotify.track import download_track
+from typing import Dict, Iterator
+
+from zotify.const import ID, TRACK, TRACKS, NAME, TYPE, OWNER, DISPLAY_NAME, SNAPSHOT_ID, TOTAL
+from zotify.jobs import WorkItem, TRACK_ITEM, EPISODE_ITEM, run_job
+from zotify.state import StateDB
+from zotify.termoutput import Printer, PrintChannel
 from zotify.utils import split_input
 from zotify.zotify import Zotify
 
 MY_PLAYLISTS_URL = 'https://api.spotify.com/v1/me/playlists'
 PLAYLISTS_URL = 'https://api.spotify.com/v1/playlists'
+# only the parts of a playlist item the download path reads
+PLAYLIST_ITEM_FIELDS = 'total,limit,items(track(id,name,type))'
+PLAYLIST_FIELDS = f'name,owner(display_name),snapshot_id,tracks({PLAYLIST_ITEM_FIELDS})'
 
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
+    return list(Zotify.invoke_url_paginated(MY_PLAYLISTS_URL, limit=50))
 
-    while True:
-        resp = Zotify.invoke_url_with_params(MY_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return playlists
+def get_playlist_songs(playlist_id, first_page=None) -> Iterator[dict]:
+    """ Yields the songs in a playlist, page by page """
+    return Zotify.invoke_url_paginated(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100,
+                                       first_page=first_page, fields=PLAYLIST_ITEM_FIELDS)
 
 
-def get_playlist_songs(playlist_id):
-    """ returns list of songs in a playlist """
-    songs = []
-    offset = 0
-    limit = 100
+def get_playlist(playlist_id):
+    """ Returns name, owner, snapshot id, song count and songs of a playlist, the first page of songs comes with the name """
+    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields={PLAYLIST_FIELDS}')
+    songs = get_playlist_songs(playlist_id, first_page=resp[TRACKS])
+    return resp[NAME].strip(), resp[OWNER][DISPLAY_NAME].strip(), resp[SNAPSHOT_ID], resp[TRACKS][TOTAL], songs
 
-    while True:
-        resp = Zotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
 
-    return songs
+def get_playlist_snapshot(playlist_id) -> str:
+    """ Returns the playlist's snapshot id, which changes whenever its items do """
+    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields={SNAPSHOT_ID}')
+    return resp[SNAPSHOT_ID]
 
 
-def get_playlist_info(playlist_id):
-    """ Returns information scraped from playlist """
-    (raw, resp) = Zotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=name,owner(display_name)&market=from_token')
-    return resp['name'].strip(), resp['owner']['display_name'].strip()
+def get_playlist_items(playlist_id, name, songs, total) -> Iterator[WorkItem]:
+    """ Yields the work items for a playlist url, its tracks are collected into an M3U file named after it """
+    char_num = len(str(total))
+    count = 0
+    for song in songs:
+        if song[TRACK] is None or not song[TRACK][NAME] or not song[TRACK][ID]:
+            Printer.print(PrintChannel.SKIPS, '###   SKIPPING:  SONG DOES NOT EXIST ANYMORE   ###' + "\n")
+            continue
+        count += 1
+        if song[TRACK][TYPE] == "episode": # Playlist item is a podcast episode
+            yield WorkItem(EPISODE_ITEM, song[TRACK][ID], extra_keys={'playlist_id': playlist_id}, label=song[TRACK][NAME])
+        else:
+            yield WorkItem(TRACK_ITEM, song[TRACK][ID], 'playlist', extra_keys=
+            {
+                'playlist_song_name': song[TRACK][NAME],
+                'playlist': name,
+                'playlist_num': str(count).zfill(char_num),
+                'playlist_id': playlist_id,
+                'playlist_track_id': song[TRACK][ID]
+            }, label=song[TRACK][NAME], playlist=name)
+
+
+def sync_playlist_items(playlist_id, snapshots: Dict[str, str]) -> Iterator[WorkItem]:
+    """ Yields the work items of a playlist url and records its snapshot id in snapshots
+
+    With SYNC on, a playlist whose snapshot didn't change since its last
+    finished download costs a single small request and yields no items.
+    Otherwise only items added since then are left to download, the rest
+    carry their earlier result so the M3U file still lists them.
+    """
+    synced = StateDB.get_playlist(playlist_id) if Zotify.CONFIG.get_sync() else None
+    if synced is not None and synced[0] and get_playlist_snapshot(playlist_id) == synced[0]:
+        Printer.print(PrintChannel.SKIPS, f'###   SKIPPING: PLAYLIST {playlist_id} (UNCHANGED SINCE LAST SYNC)   ###' + "\n")
+        return
+
+    name, _, snapshot_id, total, playlist_songs = get_playlist(playlist_id)
+    snapshots[playlist_id] = snapshot_id
+    if synced is None:
+        yield from get_playlist_items(playlist_id, name, playlist_songs, total)
+        return
+
+    previous = {entry['content_id']: entry for entry in synced[1]}
+    added = 0
+    for item in get_playlist_items(playlist_id, name, playlist_songs, total):
+        if item.content_id in previous:
+            item = item._replace(result=previous[item.content_id])
+        else:
+            added += 1
+        yield item
+    Printer.print(PrintChannel.PROGRESS_INFO, f'Playlist "{name}" changed, {added} new item(s)' + "\n")
 
 
 def download_playlist(playlist):
     """Downloads all the songs from a playlist"""
 
-    playlist_songs = [song for song in get_playlist_songs(playlist[ID]) if song[TRACK] is not None and song[TRACK][ID]]
-    p_bar = Printer.progress(playlist_songs, unit='song', total=len(playlist_songs), unit_scale=True)
-    enum = 1
-    for song in p_bar:
-        download_track('extplaylist', song[TRACK][ID], extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)}, disable_progressbar=True)
-        p_bar.set_description(song[TRACK][NAME])
-        enum += 1
+    playlist_songs = (song for song in get_playlist_songs(playlist[ID]) if song[TRACK] is not None and song[TRACK][ID])
+    run_job(f'playlist {playlist[NAME]}', (
+        WorkItem(EPISODE_ITEM if song[TRACK][TYPE] == 'episode' else TRACK_ITEM, song[TRACK][ID], 'extplaylist', extra_keys={'playlist': playlist[NAME], 'playlist_num': str(enum).zfill(2)}, label=song[TRACK][NAME])
+        for enum, song in enumerate(playlist_songs, start=1)), unit='song', progress=True)
 
 
 def download_from_user_playlist():
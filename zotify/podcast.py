@@ -1,11 +1,14 @@
 # import os
 from pathlib import PurePath, Path
 import time
-from typing import Optional, Tuple
+from typing import Iterator, Optional, Tuple
 
 from librespot.metadata import EpisodeId
 
-from zotify.const import ERROR, ID, ITEMS, NAME, SHOW, DURATION_MS
+from zotify.const import ERROR, ID, NAME, SHOW, DURATION_MS
+from zotify.http_client import HttpClient
+from zotify.pool import SHUTDOWN
+from zotify.stream import ChunkedReader, PartialDownload, stream_start
 from zotify.termoutput import PrintChannel, Printer
 from zotify.utils import create_download_directory, fix_filename
 from zotify.zotify import Zotify
@@ -27,31 +30,17 @@ def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
     return fix_filename(info[SHOW][NAME]), duration_ms, fix_filename(info[NAME])
 
 
-def get_show_episodes(show_id_str) -> list:
-    episodes = []
-    offset = 0
-    limit = 50
-
-    with Loader(PrintChannel.PROGRESS_INFO, "Fetching episodes..."):
-        while True:
-            resp = Zotify.invoke_url_with_params(
-                f'{SHOWS_URL}/{show_id_str}/episodes', limit=limit, offset=offset)
-            offset += limit
-            for episode in resp[ITEMS]:
-                episodes.append(episode[ID])
-            if len(resp[ITEMS]) < limit:
-                break
-
-    return episodes
+def get_show_episodes(show_id_str) -> Iterator[str]:
+    for episode in Zotify.invoke_url_paginated(f'{SHOWS_URL}/{show_id_str}/episodes', limit=50):
+        yield episode[ID]
 
 
 def download_podcast_directly(url, filename):
     import functools
     import shutil
-    import requests
     from tqdm.auto import tqdm
 
-    r = requests.get(url, stream=True, allow_redirects=True)
+    r = HttpClient.get(url, stream=True, allow_redirects=True)
     if r.status_code != 200:
         r.raise_for_status()  # Will only raise for 4xx codes, so...
         raise RuntimeError(
@@ -64,14 +53,17 @@ def download_podcast_directly(url, filename):
     desc = "(Unknown total file size)" if file_size == 0 else ""
     r.raw.read = functools.partial(
         r.raw.read, decode_content=True)  # Decompress if needed
+    temp_path = path.with_name(f'.{path.name}.tmp')
     with tqdm.wrapattr(r.raw, "read", total=file_size, desc=desc) as r_raw:
-        with path.open("wb") as f:
+        with temp_path.open("wb") as f:
             shutil.copyfileobj(r_raw, f)
+    temp_path.replace(path)
 
     return path
 
 
-def download_episode(episode_id) -> None:
+def download_episode(episode_id, disable_progressbar=False) -> bool:
+    """ Downloads an episode, returns whether it is saved, or was already """
     podcast_name, duration_ms, episode_name = get_episode_info(episode_id)
     extra_paths = podcast_name + '/'
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
@@ -80,6 +72,7 @@ def download_episode(episode_id) -> None:
     if podcast_name is None:
         Printer.print(PrintChannel.SKIPS, '###   SKIPPING: (EPISODE NOT FOUND)   ###')
         prepare_download_loader.stop()
+        return False
     else:
         filename = podcast_name + ' - ' + episode_name
 
@@ -92,47 +85,70 @@ def download_episode(episode_id) -> None:
         create_download_directory(download_directory)
 
         if "anon-podcast.scdn.co" in direct_download_url or "audio_preview_url" not in resp:
-            episode_id = EpisodeId.from_base62(episode_id)
             stream = Zotify.get_content_stream(
-                episode_id, Zotify.DOWNLOAD_QUALITY)
+                EpisodeId.from_base62(episode_id), Zotify.DOWNLOAD_QUALITY)
 
-            total_size = stream.input_stream.size
+            input_stream = stream.input_stream.stream()
+            # the stream starts past the header, which size still counts
+            start = stream_start(input_stream)
+            content_size = stream.input_stream.size - start
 
             filepath = PurePath(download_directory).joinpath(f"{filename}.ogg")
             if (
                 Path(filepath).is_file()
-                and Path(filepath).stat().st_size == total_size
+                and Path(filepath).stat().st_size == content_size
                 and Zotify.CONFIG.get_skip_existing()
             ):
                 Printer.print(PrintChannel.SKIPS, "\n###   SKIPPING: " + podcast_name + " - " + episode_name + " (EPISODE ALREADY EXISTS)   ###")
                 prepare_download_loader.stop()
-                return
+                return True
+
+            partial = None
+            if Zotify.CONFIG.get_temp_download_dir() != '':
+                # staged so an interrupted episode continues where it stopped
+                sink = partial = PartialDownload(Zotify.CONFIG.get_temp_download_dir(), episode_id,
+                                                 content_size, str(Zotify.DOWNLOAD_QUALITY), key=str(filepath))
+            else:
+                # moved into place once complete, an existing file is replaced, never written into
+                filepath_temp = PurePath(download_directory).joinpath(f'.{filename}.ogg.tmp')
+                sink = open(filepath_temp, 'wb')
 
             prepare_download_loader.stop()
             time_start = time.time()
             downloaded = 0
-            with open(filepath, 'wb') as file, Printer.progress(
+            resumed = partial.position if partial is not None else 0
+            if resumed:
+                input_stream.seek(start + resumed)
+            with sink as file, Printer.progress(
                 desc=filename,
-                total=total_size,
+                total=content_size,
+                initial=resumed,
                 unit='B',
                 unit_scale=True,
-                unit_divisor=1024
+                unit_divisor=1024,
+                disable=disable_progressbar
             ) as p_bar:
                 prepare_download_loader.stop()
-                while True:
-                #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                    data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
+                for data in ChunkedReader(input_stream, content_size, Zotify.CONFIG.get_chunk_size(), resumed):
+                    if SHUTDOWN.is_set():
+                        raise KeyboardInterrupt
                     p_bar.update(file.write(data))
                     downloaded += len(data)
-                    if data == b'':
-                        break
                     if Zotify.CONFIG.get_download_real_time():
                         delta_real = time.time() - time_start
-                        delta_want = (downloaded / total_size) * (duration_ms/1000)
+                        delta_want = (downloaded / content_size) * (duration_ms/1000)
                         if delta_want > delta_real:
                             time.sleep(delta_want - delta_real)
+
+            if partial is not None:
+                if partial.position < content_size:
+                    raise IOError(f'stream ended after {partial.position} of {content_size} bytes')
+                partial.complete(filepath)
+            else:
+                Path(filepath_temp).replace(filepath)
         else:
             filepath = PurePath(download_directory).joinpath(f"{filename}.mp3")
             download_podcast_directly(direct_download_url, filepath)
 
     prepare_download_loader.stop()
+    return True
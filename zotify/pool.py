@@ -0,0 +1,140 @@
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Executor
+from typing import Callable, Iterable, Iterator
+
+from zotify.termoutput import Printer, PrintChannel
+from zotify.zotify import Zotify
+
+
+# set once the user interrupts a run, running jobs poll it to abort early
+SHUTDOWN = threading.Event()
+
+
+def map_ordered(executor: Executor, func: Callable, iterable: Iterable, window: int) -> Iterator:
+    """ Like executor.map, but pulls from iterable lazily and keeps at most window calls in flight """
+    pending = deque()
+    for arg in iterable:
+        pending.append(executor.submit(func, arg))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class DownloadPool:
+    """ Runs download jobs on a bounded pool of worker threads
+
+    Jobs are started and reported in submission order, so the progress bar and
+    result callback always follow album/playlist order even when jobs finish
+    out of order. With a single worker every job runs inline on the caller's
+    thread, exactly like a plain loop.
+
+    with DownloadPool(total=len(tracks), unit='Song') as pool:
+        for track in tracks:
+            pool.submit(download_track, 'album', track[ID], disable_progressbar=True)
+    """
+
+    def __init__(self, total=None, unit='it', desc=None, callback=None, progress=True):
+        """
+        Args:
+            total (int, optional): Number of jobs, used for the progress bar.
+            unit (str, optional): Progress bar unit.
+            desc (str, optional): Progress bar description.
+            callback (callable, optional): Called with each job's result, in submission order.
+            progress (bool, optional): Show the progress bar. Always shown when running in parallel.
+        """
+        self.workers = max(1, Zotify.CONFIG.get_workers())
+        self.parallel = self.workers > 1
+        self.callback = callback
+
+        self._pending = deque()
+        self._executor = None
+        if self.parallel:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='zotify-download')
+        self._p_bar = Printer.progress(desc=desc, total=total, unit=unit, unit_scale=True,
+                                       disable=not (progress or self.parallel))
+
+    def submit(self, func, *args, label=None, **kwargs) -> None:
+        """ Queues func(*args, **kwargs), blocking while too many jobs are outstanding """
+        if SHUTDOWN.is_set():
+            return
+
+        if not self.parallel:
+            self._report(self._run(func, *args, **kwargs), label)
+            return
+
+        # keep at most two jobs per worker in flight so huge collections don't
+        # pile up thousands of futures
+        while len(self._pending) >= self.workers * 2:
+            self._drain(block=True)
+        self._pending.append((self._executor.submit(self._run, func, *args, **kwargs), label))
+        self._drain(block=False)
+
+    def set_total(self, total: int) -> None:
+        """ Updates the progress bar total, for job lists that grow while downloading """
+        self._p_bar.total = total
+        self._p_bar.refresh()
+
+    def join(self) -> None:
+        """ Waits for all queued jobs and reports their results """
+        while self._pending:
+            self._drain(block=True)
+
+    def shutdown(self) -> None:
+        """ Cancels queued jobs and asks running ones to stop """
+        SHUTDOWN.set()
+        if self._executor is not None:
+            running = 0
+            for future, _ in self._pending:
+                if not future.cancel():
+                    running += 1
+            if running:
+                Printer.print(PrintChannel.WARNINGS, f'\n###   STOPPING: WAITING FOR {running} RUNNING DOWNLOAD(S) TO ABORT   ###')
+            self._pending.clear()
+            self._executor.shutdown(wait=True)
+
+    def _drain(self, block: bool) -> None:
+        while self._pending and (block or self._pending[0][0].done()):
+            future, label = self._pending.popleft()
+            self._report(future.result(), label)
+            block = False
+
+    def _report(self, result, label) -> None:
+        if label is not None:
+            self._p_bar.set_description(label)
+        self._p_bar.update(1)
+        if self.callback is not None:
+            self.callback(result)
+
+    @staticmethod
+    def _run(func, *args, **kwargs):
+        """ Runs a single job, one failing job never takes the others down """
+        if SHUTDOWN.is_set():
+            return None
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            Printer.print(PrintChannel.ERRORS, '###   SKIPPING: (GENERAL DOWNLOAD ERROR)   ###')
+            Printer.print(PrintChannel.ERRORS, str(e) + "\n")
+            Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.join()
+        except BaseException:
+            self.shutdown()
+            raise
+        finally:
+            self._p_bar.close()
+
+        if exc_type is not None:
+            self.shutdown()
+        elif self._executor is not None:
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,110 @@
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+from urllib.parse import urlencode
+
+from zotify.config import Config
+
+DAY = 24 * 60 * 60
+# seconds a response is served without asking the API, by url pattern, first match wins.
+# urls matching none of these, like the user's library or search, are never cached
+RESPONSE_TTLS = (
+    # collections change any time, a short ttl only spares the repeats within one run
+    # and later runs revalidate them, so a new episode or release shows up right away
+    (re.compile(r'^https://api\.spotify\.com/v1/playlists/'), 60),
+    (re.compile(r'^https://api\.spotify\.com/v1/shows/[^/]+/episodes'), 60),
+    (re.compile(r'^https://api\.spotify\.com/v1/artists/[^/]+/albums'), 60),
+    (re.compile(r'^https://api\.spotify\.com/v1/artists/'), 7 * DAY),
+    # single items only, multi-id batches are made up by timing and would never repeat
+    (re.compile(r'^https://api\.spotify\.com/v1/(tracks|albums|episodes|audio-features)/'), 30 * DAY),
+    (re.compile(r'^https://spclient\.wg\.spotify\.com/color-lyrics/'), 30 * DAY),
+)
+# expired responses are kept this long for revalidation before they are pruned
+RESPONSE_MAX_AGE = 90 * DAY
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    etag TEXT,
+    body TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+'''
+
+
+class CachedResponse(NamedTuple):
+    text: str
+    etag: Optional[str]
+    fresh: bool
+
+
+class ResponseCache:
+    """ Web API responses cached on disk across runs, keyed by url, language and account
+
+    Fresh responses are served without a request. Expired ones that came with
+    an ETag are revalidated with If-None-Match, and a 304 serves the stored
+    body again, so a rerun mostly costs empty responses. How long a response
+    stays fresh depends on its endpoint, see RESPONSE_TTLS. The account is
+    part of the key since market=from_token responses depend on it.
+    """
+    _connection: sqlite3.Connection = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def connection(cls) -> sqlite3.Connection:
+        with cls._lock:
+            if cls._connection is None:
+                path = Path(Config.get_cache_dir()).joinpath('responses.db')
+                connection = sqlite3.connect(str(path), check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.executescript(SCHEMA)
+                with connection:
+                    connection.execute('DELETE FROM responses WHERE fetched < ?', (time.time() - RESPONSE_MAX_AGE,))
+                cls._connection = connection
+            return cls._connection
+
+    @classmethod
+    def get_ttl(cls, url: str) -> Optional[int]:
+        for pattern, ttl in RESPONSE_TTLS:
+            if pattern.match(url):
+                return ttl
+        return None
+
+    @classmethod
+    def get_key(cls, url: str, params: Optional[dict], account: str) -> Optional[str]:
+        """ Returns the cache key of a request, None if its response isn't cached """
+        if not Config.get_response_cache() or cls.get_ttl(url) is None:
+            return None
+        if params:
+            url = f'{url}{"&" if "?" in url else "?"}{urlencode(sorted(params.items()))}'
+        return f'{Config.get_language()} {account} {url}'
+
+    @classmethod
+    def get(cls, key: str) -> Optional[CachedResponse]:
+        with cls._lock:
+            rows = cls.connection().execute('SELECT etag, body, fetched FROM responses WHERE key = ?', (key,)).fetchall()
+        if not rows:
+            return None
+        etag, body, fetched = rows[0]
+        # the key ends with the url, after the language and account
+        return CachedResponse(body, etag, time.time() - fetched < cls.get_ttl(key.rsplit(' ', 1)[1]))
+
+    @classmethod
+    def put(cls, key: str, text: str, etag: Optional[str]) -> None:
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO responses (key, etag, body, fetched) VALUES (?, ?, ?, ?)',
+                                   (key, etag, text, time.time()))
+
+    @classmethod
+    def refresh(cls, key: str) -> None:
+        """ Marks a response the API confirmed unchanged as fresh again """
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                connection.execute('UPDATE responses SET fetched = ? WHERE key = ?', (time.time(), key))
@@ -0,0 +1,289 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from zotify.config import Config
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# finished jobs kept around for reference, older ones are pruned
+KEEP_FINISHED_JOBS = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    created REAL NOT NULL,
+    expanded INTEGER NOT NULL DEFAULT 0,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    content_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    extra_keys TEXT,
+    label TEXT,
+    playlist TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    path TEXT,
+    artist TEXT,
+    name TEXT,
+    duration_ms INTEGER,
+    duplicate_of INTEGER,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE TABLE IF NOT EXISTS job_playlists (
+    job_id INTEGER NOT NULL,
+    playlist_id TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    PRIMARY KEY (job_id, playlist_id)
+);
+CREATE TABLE IF NOT EXISTS job_watermarks (
+    job_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    track_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (track_id, variant, path)
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist_id TEXT PRIMARY KEY,
+    snapshot_id TEXT NOT NULL,
+    items TEXT NOT NULL,
+    synced REAL NOT NULL
+);
+'''
+
+
+class StateDB:
+    """ SQLite database in the config directory holding state that outlives a run
+
+    Bulk runs are journaled here: the expanded work list of every job and the
+    state of each item, so an interrupted run can be continued with --resume
+    without expanding its collections again. When a job finishes, the
+    snapshot and downloaded items of every playlist in it, and watermarks
+    like the newest liked song it saw, are kept for --sync. Every finished
+    track file is recorded too, so another path of it can be linked or copied.
+    One connection is shared by all threads and every statement runs under a
+    lock.
+    """
+    _connection: sqlite3.Connection = None
+    _lock = threading.RLock()
+
+    @classmethod
+    def connection(cls) -> sqlite3.Connection:
+        with cls._lock:
+            if cls._connection is None:
+                connection = sqlite3.connect(str(Config.get_state_db()), check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute('PRAGMA synchronous=NORMAL')
+                connection.executescript(SCHEMA)
+                cls._connection = connection
+            return cls._connection
+
+    @classmethod
+    def execute(cls, sql: str, params=()) -> List[Tuple]:
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                return connection.execute(sql, params).fetchall()
+
+    @classmethod
+    def create_job(cls, command: str) -> int:
+        """ Records a new job, returns its id. Items are added while its collections are expanded """
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                return connection.execute('INSERT INTO jobs (command, created) VALUES (?, ?)',
+                                          (command, time.time())).lastrowid
+
+    @classmethod
+    def add_job_items(cls, job_id: int, start: int, items: List[Dict[str, Any]]) -> None:
+        """ Appends work items to a job, numbered from start
+
+        Ones with a result from an earlier run are recorded as done, ones with a
+        duplicate_of seq take the result of that item instead of downloading.
+        """
+        rows = []
+        for seq, item in enumerate(items, start=start):
+            result = item.get('result') or {}
+            rows.append((job_id, seq, item['kind'], item['content_id'], item['mode'],
+                         json.dumps(item['extra_keys']) if item.get('extra_keys') else None,
+                         item.get('label'), item.get('playlist'), DONE if result else PENDING,
+                         result.get('path'), result.get('artist'), result.get('name'), result.get('duration_ms'),
+                         item.get('duplicate_of')))
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                connection.executemany(
+                    'INSERT INTO job_items (job_id, seq, kind, content_id, mode, extra_keys, label, playlist, '
+                    'state, path, artist, name, duration_ms, duplicate_of) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    @classmethod
+    def set_job_expanded(cls, job_id: int, playlists: Optional[Dict[str, str]] = None,
+                         watermarks: Optional[Dict[str, str]] = None) -> None:
+        """ Marks the work list of a job complete
+
+        Args:
+            playlists (dict, optional): Snapshot id of every playlist expanded into the job, by playlist id.
+            watermarks (dict, optional): Watermarks to store once every item of the job is done.
+        """
+        with cls._lock:
+            connection = cls.connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO job_playlists (job_id, playlist_id, snapshot_id) VALUES (?, ?, ?)',
+                                       [(job_id, playlist_id, snapshot_id)
+                                        for playlist_id, snapshot_id in (playlists or {}).items()])
+                connection.executemany('INSERT OR REPLACE INTO job_watermarks (job_id, name, value) VALUES (?, ?, ?)',
+                                       [(job_id, name, value) for name, value in (watermarks or {}).items()])
+                connection.execute('UPDATE jobs SET expanded = 1 WHERE id = ?', (job_id,))
+
+    @classmethod
+    def get_unfinished_job(cls) -> Optional[Tuple[int, str, bool]]:
+        """ Returns id, command and whether the work list is complete, of the most recent job that didn't finish """
+        rows = cls.execute('SELECT id, command, expanded FROM jobs WHERE finished IS NULL ORDER BY id DESC LIMIT 1')
+        return (rows[0][0], rows[0][1], bool(rows[0][2])) if rows else None
+
+    @classmethod
+    def is_job_expanded(cls, job_id: int) -> bool:
+        return bool(cls.execute('SELECT expanded FROM jobs WHERE id = ?', (job_id,))[0][0])
+
+    @classmethod
+    def count_job_items(cls, job_id: int, state: Optional[str] = None) -> int:
+        if state is None:
+            return cls.execute('SELECT COUNT(*) FROM job_items WHERE job_id = ?', (job_id,))[0][0]
+        return cls.execute('SELECT COUNT(*) FROM job_items WHERE job_id = ? AND state = ?', (job_id, state))[0][0]
+
+    @classmethod
+    def get_job_items(cls, job_id: int, start: int = 0, limit: int = -1, in_playlist: bool = False) -> List[Dict[str, Any]]:
+        """ Returns items of a job in order, with their state and download result
+
+        Args:
+            start (int, optional): First seq to return.
+            limit (int, optional): Most items to return, all by default.
+            in_playlist (bool, optional): Only items listed in an M3U file.
+        """
+        rows = cls.execute(
+            'SELECT seq, kind, content_id, mode, extra_keys, label, playlist, state, path, artist, name, duration_ms, '
+            'duplicate_of '
+            'FROM job_items WHERE job_id = ? AND seq >= ? ' + ('AND playlist IS NOT NULL ' if in_playlist else '') +
+            'ORDER BY seq LIMIT ?', (job_id, start, limit))
+        return [{
+            'seq': seq,
+            'kind': kind,
+            'content_id': content_id,
+            'mode': mode,
+            'extra_keys': json.loads(extra_keys) if extra_keys else None,
+            'label': label,
+            'playlist': playlist,
+            'state': state,
+            'path': path,
+            'artist': artist,
+            'name': name,
+            'duration_ms': duration_ms,
+            'duplicate_of': duplicate_of,
+        } for (seq, kind, content_id, mode, extra_keys, label, playlist, state, path, artist, name, duration_ms,
+               duplicate_of) in rows]
+
+    @classmethod
+    def set_item_state(cls, job_id: int, seq: int, state: str, path: Optional[str] = None,
+                       artist: Optional[str] = None, name: Optional[str] = None,
+                       duration_ms: Optional[int] = None) -> None:
+        cls.execute('UPDATE job_items SET state = ?, path = ?, artist = ?, name = ?, duration_ms = ? '
+                    'WHERE job_id = ? AND seq = ?', (state, path, artist, name, duration_ms, job_id, seq))
+
+    @classmethod
+    def resolve_duplicates(cls, job_id: int) -> None:
+        """ Copies the state and result of every item to the items that duplicate it """
+        cls.execute('UPDATE job_items SET '
+                    '(state, path, artist, name, duration_ms) = (SELECT original.state, original.path, original.artist, '
+                    'original.name, original.duration_ms FROM job_items AS original '
+                    'WHERE original.job_id = job_items.job_id AND original.seq = job_items.duplicate_of) '
+                    'WHERE job_id = ? AND duplicate_of IS NOT NULL', (job_id,))
+
+    @classmethod
+    def finish_job(cls, job_id: int) -> None:
+        """ Marks a job finished and records the playlists it synced """
+        with cls._lock:
+            playlists = cls.execute('SELECT playlist_id, snapshot_id FROM job_playlists WHERE job_id = ?', (job_id,))
+            watermarks = cls.execute('SELECT name, value FROM job_watermarks WHERE job_id = ?', (job_id,))
+            items = cls.get_job_items(job_id) if playlists else []
+            # moving a watermark past a failed item would skip it on every later sync
+            if watermarks and cls.count_job_items(job_id, DONE) < cls.count_job_items(job_id):
+                watermarks = []
+
+            connection = cls.connection()
+            with connection:
+                for playlist_id, snapshot_id in playlists:
+                    synced = [item for item in items
+                              if item['extra_keys'] and item['extra_keys'].get('playlist_id') == playlist_id]
+                    if any(item['state'] != DONE for item in synced):
+                        # something failed, make the next sync look at this playlist again
+                        snapshot_id = ''
+                    connection.execute(
+                        'INSERT OR REPLACE INTO playlists (playlist_id, snapshot_id, items, synced) VALUES (?, ?, ?, ?)',
+                        (playlist_id, snapshot_id, json.dumps([
+                            {key: item[key] for key in ('content_id', 'kind', 'path', 'artist', 'name', 'duration_ms')}
+                            for item in synced if item['state'] == DONE]), time.time()))
+                connection.executemany('INSERT OR REPLACE INTO watermarks (name, value) VALUES (?, ?)', watermarks)
+
+                connection.execute('UPDATE jobs SET finished = ? WHERE id = ?', (time.time(), job_id))
+                stale = [row[0] for row in connection.execute(
+                    'SELECT id FROM jobs WHERE finished IS NOT NULL ORDER BY id DESC LIMIT -1 OFFSET ?',
+                    (KEEP_FINISHED_JOBS,))]
+                connection.executemany('DELETE FROM job_items WHERE job_id = ?', [(i,) for i in stale])
+                connection.executemany('DELETE FROM job_playlists WHERE job_id = ?', [(i,) for i in stale])
+                connection.executemany('DELETE FROM job_watermarks WHERE job_id = ?', [(i,) for i in stale])
+                connection.executemany('DELETE FROM jobs WHERE id = ?', [(i,) for i in stale])
+
+    @classmethod
+    def get_playlist(cls, playlist_id: str) -> Optional[Tuple[str, List[Dict[str, Any]]]]:
+        """ Returns the snapshot id and downloaded items of a playlist as of its last finished job """
+        rows = cls.execute('SELECT snapshot_id, items FROM playlists WHERE playlist_id = ?', (playlist_id,))
+        if not rows:
+            return None
+        return rows[0][0], json.loads(rows[0][1])
+
+    @classmethod
+    def get_watermark(cls, name: str) -> Optional[str]:
+        """ Returns a watermark stored by a finished job """
+        rows = cls.execute('SELECT value FROM watermarks WHERE name = ?', (name,))
+        return rows[0][0] if rows else None
+
+    @classmethod
+    def add_file(cls, track_id: str, variant: str, path: str) -> None:
+        """ Records a finished track file, variant is its format and quality """
+        cls.execute('INSERT OR REPLACE INTO files (track_id, variant, path, size) VALUES (?, ?, ?, ?)',
+                    (track_id, variant, path, os.path.getsize(path)))
+
+    @classmethod
+    def get_file(cls, track_id: str, variant: str, exclude: Optional[str] = None) -> Optional[str]:
+        """ Returns a recorded file of a track that is still in place, forgetting ones that were moved or changed """
+        for (path, size) in cls.execute('SELECT path, size FROM files WHERE track_id = ? AND variant = ?',
+                                        (track_id, variant)):
+            if path == exclude:
+                continue
+            try:
+                if os.path.getsize(path) == size:
+                    return path
+            except OSError:
+                pass
+            cls.execute('DELETE FROM files WHERE track_id = ? AND variant = ? AND path = ?', (track_id, variant, path))
+        return None
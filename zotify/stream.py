@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Iterator, Union
+
+# bounds for the adaptive chunk size
+MIN_CHUNK_SIZE = 4 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+# chunks are sized so one read takes about this long, long enough to amortise
+# the per-call overhead and short enough to keep progress output responsive
+TARGET_READ_TIME = 0.05
+# reads that return nothing before total_size is reached, before giving up
+MAX_EMPTY_READS = 5
+# seconds between sidecar updates while a partial download is written
+CHECKPOINT_INTERVAL = 1.0
+
+
+def stream_start(stream) -> int:
+    """ Returns the offset a content stream starts reading at
+
+    librespot reads the 0xA7 byte normalization header and skips past it
+    before handing the stream over, while its size still counts the header.
+    """
+    pos = getattr(stream, 'pos', None)
+    return pos() if callable(pos) else stream.tell()
+
+
+def _implements_readinto(stream) -> bool:
+    """ True if stream's readinto is at least as specific as its read
+
+    librespot's chunked stream overrides read() on top of io.BytesIO, so its
+    inherited readinto() would read the empty BytesIO buffer instead.
+    """
+    read_owner = next((c for c in type(stream).__mro__ if 'read' in vars(c)), None)
+    readinto_owner = next((c for c in type(stream).__mro__ if 'readinto' in vars(c)), None)
+    return readinto_owner is not None and read_owner is not None and issubclass(readinto_owner, read_owner)
+
+
+class ChunkedReader:
+    """ Reads a content stream of known size in adaptively sized chunks
+
+    Streams that implement readinto are read into one preallocated buffer and
+    yielded as memoryviews, which are only valid until the next chunk is read.
+    Other streams yield the bytes returned by read. The chunk size doubles
+    while reads finish well under TARGET_READ_TIME and halves when they take
+    much longer, and reading stops once total_size bytes have arrived.
+
+    for chunk in ChunkedReader(stream.input_stream.stream(), total_size):
+        file.write(chunk)
+    """
+
+    def __init__(self, stream, total_size: int, chunk_size: int = 20000, position: int = 0):
+        """
+        Args:
+            position (int, optional): Bytes already read, for a stream that was seeked to resume.
+        """
+        self.stream = stream
+        self.total_size = total_size
+        self.chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+        self.position = position
+
+        self._view = None
+        if _implements_readinto(stream):
+            self._view = memoryview(bytearray(MAX_CHUNK_SIZE))
+
+    def read_chunk(self) -> Union[bytes, memoryview]:
+        size = min(self.chunk_size, self.total_size - self.position)
+        if size <= 0:
+            return b''
+
+        start = time.monotonic()
+        if self._view is not None:
+            chunk = self._view[:self.stream.readinto(self._view[:size]) or 0]
+        else:
+            chunk = self.stream.read(size)
+        self._adapt(len(chunk), size, time.monotonic() - start)
+
+        self.position += len(chunk)
+        return chunk
+
+    def _adapt(self, received: int, requested: int, elapsed: float) -> None:
+        if received == requested and elapsed < TARGET_READ_TIME / 2:
+            self.chunk_size = min(self.chunk_size * 2, MAX_CHUNK_SIZE)
+        elif elapsed > TARGET_READ_TIME * 2:
+            self.chunk_size = max(self.chunk_size // 2, MIN_CHUNK_SIZE)
+
+    def __iter__(self) -> Iterator[Union[bytes, memoryview]]:
+        empty_reads = 0
+        while self.position < self.total_size and empty_reads < MAX_EMPTY_READS:
+            chunk = self.read_chunk()
+            if len(chunk) == 0:
+                empty_reads += 1
+                continue
+            empty_reads = 0
+            yield chunk
+
+
+class PartialDownload:
+    """ Download sink staged in the temp directory that survives failed runs
+
+    Bytes go to a .part file and a JSON sidecar next to it records the content
+    id, the expected size and how many bytes are safely on disk. A later
+    download of the same content to the same place picks up at that offset,
+    anything that doesn't match starts over. Positions count from the start
+    of the stream's content, not of the file librespot serves.
+
+    with PartialDownload(temp_dir, track_id, total_size, key=filename) as file:
+        stream.seek(start + file.position)
+        for chunk in ChunkedReader(stream, total_size, position=file.position):
+            file.write(chunk)
+    file.complete(filename)
+    """
+
+    def __init__(self, directory, content_id: str, total_size: int, variant: str = '', key: str = ''):
+        """
+        Args:
+            directory (str): Temp download directory.
+            content_id (str): Track or episode id.
+            total_size (int): Expected size of the finished download.
+            variant (str, optional): Anything else the bytes depend on, like the audio quality.
+            key (str, optional): What the download is for, like its output path, so two writers
+                of the same content never share a staging file.
+        """
+        self.content_id = content_id
+        self.total_size = total_size
+        self.variant = variant
+        name = f'zotify_{content_id}_{hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]}'
+        self.path = Path(directory) / f'{name}.part'
+        self.sidecar = Path(directory) / f'{name}.part.json'
+        self.position = self._load()
+        self._file = None
+        self._saved_at = 0.0
+
+    def _load(self) -> int:
+        try:
+            with open(self.sidecar, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            size = self.path.stat().st_size
+        except (OSError, ValueError):
+            return 0
+        if (state.get('content_id'), state.get('variant'), state.get('total_size')) != \
+                (self.content_id, self.variant, self.total_size):
+            return 0
+        return max(min(int(state.get('bytes_written', 0)), size, self.total_size), 0)
+
+    def _save(self) -> None:
+        state = {
+            'content_id': self.content_id,
+            'variant': self.variant,
+            'total_size': self.total_size,
+            'bytes_written': self.position,
+        }
+        temp = self.sidecar.with_name(self.sidecar.name + '.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp, self.sidecar)
+        self._saved_at = time.monotonic()
+
+    def write(self, data) -> int:
+        written = self._file.write(data)
+        self.position += written
+        if time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL:
+            # the sidecar must never claim bytes that are still in our buffer
+            self._file.flush()
+            self._save()
+        return written
+
+    def complete(self, filename) -> None:
+        """ Moves the finished download to filename and forgets its progress
+
+        A file already at filename is replaced, never written into, even when
+        the download has to be copied over from another filesystem.
+        """
+        temp = Path(f'{filename}.part')
+        shutil.move(str(self.path), str(temp))
+        temp.replace(filename)
+        self.sidecar.unlink(missing_ok=True)
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.sidecar.unlink(missing_ok=True)
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.position:
+            # drop anything written after the last checkpoint
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(self.position)
+            self._file.seek(self.position)
+        else:
+            self._file = open(self.path, 'wb')
+        self._save()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        # record progress on the way out, failed or not, so the next attempt resumes
+        self._file.close()
+        self._save()
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+# librespot only mints a new token once the cached one is within 10 seconds
+# of expiring, so the background refresh has to run inside that window
+REFRESH_MARGIN = 8
+# seconds to wait before retrying a failed background refresh
+RETRY_DELAY = 2
+# assumed lifetime for tokens that don't report one
+DEFAULT_EXPIRES_IN = 3600
+
+
+class TokenCache:
+    """ In-memory bearer token cache keyed by scope set
+
+    Tokens are served from memory and refreshed on a background timer shortly
+    before they expire, so API calls never wait for token acquisition. When a
+    token does have to be fetched inline, concurrent callers share that one
+    fetch instead of each asking the session.
+    """
+
+    def __init__(self, fetch: Callable, expire: Optional[Callable] = None):
+        """
+        Args:
+            fetch (callable): Called with the scopes, returns an object with access_token and expires_in.
+            expire (callable, optional): Called with the scopes of a rejected token, so that fetch
+                doesn't hand the same token back.
+        """
+        self._fetch = fetch
+        self._expire = expire
+        self._tokens: Dict[frozenset, Tuple[str, float]] = {}
+        self._locks: Dict[frozenset, threading.Lock] = {}
+        self._timers: Dict[frozenset, threading.Timer] = {}
+        self._lock = threading.Lock()
+
+    def get(self, *scopes) -> str:
+        key = frozenset(scopes)
+        entry = self._tokens.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return self._refresh(key, scopes, entry)
+
+    def invalidate(self, *scopes) -> None:
+        """ Drops a token the API rejected, the next get fetches a new one """
+        key = frozenset(scopes)
+        with self._key_lock(key):
+            self._tokens.pop(key, None)
+            if self._expire is not None:
+                self._expire(*scopes)
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _refresh(self, key, scopes, stale) -> str:
+        with self._key_lock(key):
+            entry = self._tokens.get(key)
+            # someone else refreshed while we waited for the lock
+            if entry is not None and entry is not stale and entry[1] > time.monotonic():
+                return entry[0]
+
+            token = self._fetch(*scopes)
+            expires_in = getattr(token, 'expires_in', None) or DEFAULT_EXPIRES_IN
+            if stale is not None and token.access_token == stale[0]:
+                # the session handed back the token we already had, keep its deadline
+                entry = (token.access_token, stale[1])
+            else:
+                entry = (token.access_token, time.monotonic() + expires_in)
+            self._tokens[key] = entry
+            self._schedule(key, scopes, entry)
+            return entry[0]
+
+    def _schedule(self, key, scopes, entry) -> None:
+        delay = max(entry[1] - time.monotonic() - REFRESH_MARGIN, RETRY_DELAY)
+        timer = threading.Timer(delay, self._background_refresh, (key, scopes, entry))
+        timer.daemon = True
+        with self._lock:
+            if key in self._timers:
+                self._timers[key].cancel()
+            self._timers[key] = timer
+        timer.start()
+
+    def _background_refresh(self, key, scopes, entry) -> None:
+        if self._tokens.get(key) is not entry:
+            return
+        try:
+            self._refresh(key, scopes, entry)
+        except Exception:
+            # keep serving the current token, try again shortly
+            if entry[1] > time.monotonic():
+                self._schedule(key, scopes, entry)
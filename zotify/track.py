@@ -1,97 +1,259 @@
 from pathlib import Path, PurePath
+import itertools
+import json
 import math
-import re
+import shutil
+import threading
 import time
 import uuid
-from typing import Any, Tuple, List
+from typing import Any, Callable, Dict, Iterator, Tuple, List, NamedTuple, Optional
 
 from librespot.metadata import TrackId
 import ffmpy
 
-from zotify.const import TRACKS, ALBUM, GENRES, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
+from zotify.const import TRACKS, ALBUM, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, IMAGES, URL, \
     RELEASE_DATE, ID, TRACKS_URL, FOLLOWED_ARTISTS_URL, SAVED_TRACKS_URL, TRACK_STATS_URL, CODEC_MAP, EXT_MAP, DURATION_MS, \
-    HREF, ARTISTS, WIDTH
+    ARTISTS, WIDTH, ADDED_AT
+from zotify.cache import ArtworkCache, GenreCache
+from zotify.materialize import TrackFiles, materialize_file, HARDLINK, REFLINK, COPY, DOWNLOAD
+from zotify.pool import SHUTDOWN
+from zotify.response_cache import ResponseCache
+from zotify.state import StateDB
+from zotify.stream import ChunkedReader, PartialDownload, stream_start
 from zotify.termoutput import Printer, PrintChannel
-from zotify.utils import fix_filename, set_audio_tags, set_music_thumbnail, create_download_directory, \
-    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds
+from zotify.transcode import TranscodePipe, TranscodePool
+from zotify.utils import fix_filename, set_audio_tags, save_cover_art, create_download_directory, \
+    get_directory_song_ids, add_to_directory_song_ids, get_previously_downloaded, add_to_archive, fmt_seconds, \
+    DirectoryIndex
 from zotify.zotify import Zotify
 import traceback
 from zotify.loader import Loader
 
 
-def get_saved_tracks() -> list:
-    """ Returns user's saved tracks """
-    songs = []
+def get_saved_tracks() -> Iterator[dict]:
+    """ Yields user's saved tracks """
+    return Zotify.invoke_url_paginated(SAVED_TRACKS_URL, limit=50)
+
+
+def get_saved_tracks_since(added_at: str) -> Iterator[dict]:
+    """ Yields tracks saved after added_at, newest first
+
+    The endpoint lists the newest saves first, so paging stops at the first
+    track that is not newer than added_at.
+    """
     offset = 0
     limit = 50
 
     while True:
-        resp = Zotify.invoke_url_with_params(
-            SAVED_TRACKS_URL, limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
+        resp = Zotify.invoke_url_with_params(SAVED_TRACKS_URL, limit=limit, offset=offset)
+        if ITEMS not in resp:
+            raise ValueError(f'Invalid response from {SAVED_TRACKS_URL} at offset {offset}:\n{resp}')
+        for song in resp[ITEMS]:
+            # ISO 8601 timestamps in UTC compare correctly as strings
+            if song[ADDED_AT] <= added_at:
+                return
+            yield song
         if len(resp[ITEMS]) < limit:
-            break
-
-    return songs
+            return
+        offset += limit
 
 
 def get_followed_artists() -> list:
     """ Returns user's followed artists """
     artists = []
-    resp = Zotify.invoke_url(FOLLOWED_ARTISTS_URL)[1]
-    for artist in resp[ARTISTS][ITEMS]:
-        artists.append(artist[ID])
-    
+    # the endpoint pages by cursor, its next url carries the after cursor
+    url = f'{FOLLOWED_ARTISTS_URL}&limit=50'
+    while url:
+        resp = Zotify.invoke_url(url)[1]
+        for artist in resp[ARTISTS][ITEMS]:
+            artists.append(artist[ID])
+        url = resp[ARTISTS].get('next')
+
     return artists
 
 
+DOWNLOADED = 'downloaded'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+# downloaded, still being converted on the transcode pool
+CONVERTING = 'converting'
+
+
+class DownloadResult(NamedTuple):
+    """ Outcome of download_track
+
+    path is where the track was written, or the existing file it was skipped
+    for. Conversion finishes on the transcode pool, so download_track returns
+    CONVERTING for a fresh download and passes the final DOWNLOADED or FAILED
+    result to its on_finished callback once the file is in place.
+    """
+    status: str
+    track_id: str
+    path: Optional[PurePath] = None
+    artist: Optional[str] = None
+    album: Optional[str] = None
+    name: Optional[str] = None
+    duration_ms: Optional[int] = None
+
+
+class SongInfoCache:
+    """ Resolves track metadata in batches through the multi-id tracks endpoint
+
+    Jobs queue the ids they are about to download, then every cache miss in
+    get_song_info fetches the missing id together with up to 49 queued ones.
+    Entries are handed out once and dropped, so memory stays bounded by what
+    is queued. The request runs outside the lock, a worker wanting an id of a
+    batch in flight waits for that batch only.
+    """
+    BATCH_SIZE = 50
+
+    _pending = {}
+    _info = {}
+    _in_flight: Dict[str, threading.Event] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def queue(cls, track_ids) -> None:
+        """ Registers ids that will be downloaded soon, in download order """
+        with cls._lock:
+            for track_id in track_ids:
+                if track_id and track_id not in cls._info and track_id not in cls._in_flight:
+                    cls._pending[track_id] = None
+
+    @classmethod
+    def clear(cls) -> None:
+        """ Drops ids queued by a job that were never downloaded """
+        with cls._lock:
+            cls._pending.clear()
+            cls._info.clear()
+
+    @classmethod
+    def get(cls, track_id: str) -> Tuple[str, Any]:
+        """ Returns the raw json and the parsed track object for track_id """
+        while True:
+            with cls._lock:
+                if track_id in cls._info:
+                    return cls._info.pop(track_id)
+                event = cls._in_flight.get(track_id)
+                if event is None:
+                    cls._pending.pop(track_id, None)
+                    batch = [track_id] + list(itertools.islice(cls._pending, cls.BATCH_SIZE - 1))
+                    event = threading.Event()
+                    for batch_id in batch:
+                        cls._pending.pop(batch_id, None)
+                        cls._in_flight[batch_id] = event
+                else:
+                    batch = None
+
+            if batch is None:
+                event.wait()
+                continue
+
+            tracks = []
+            try:
+                tracks = cls._fetch(batch)
+            finally:
+                with cls._lock:
+                    for batch_id in batch:
+                        cls._in_flight.pop(batch_id, None)
+                event.set()
+            cls._warm_genres(tracks)
+
+    @classmethod
+    def _fetch(cls, track_ids: List[str]) -> List[Any]:
+        """ Fetches a batch into the cache, returns its tracks
+
+        Tracks are kept in the response cache one by one, since batches
+        depend on timing. Only the ones missing there are requested.
+        """
+        params = {'market': 'from_token'}
+        keys = {track_id: Zotify.get_cache_key(f'{TRACKS_URL}/{track_id}', params) for track_id in track_ids}
+        found = {}
+        for track_id, key in keys.items():
+            cached = ResponseCache.get(key) if key is not None else None
+            if cached is not None and cached.fresh:
+                found[track_id] = (cached.text, json.loads(cached.text))
+        missing = [track_id for track_id in track_ids if track_id not in found]
+
+        failed = None
+        if missing:
+            with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
+                (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={",".join(missing)}&market=from_token')
+            if TRACKS in info:
+                for track_id, track in zip(missing, info[TRACKS]):
+                    found[track_id] = (json.dumps(track), track)
+                    if track is not None and keys[track_id] is not None:
+                        ResponseCache.put(keys[track_id], found[track_id][0], None)
+            else:
+                failed = raw
+
+        with cls._lock:
+            for track_id in track_ids:
+                if track_id in found:
+                    cls._info[track_id] = found[track_id]
+                elif track_id == track_ids[0]:
+                    # only the requested id fails, the other ones are queued again
+                    cls._info[track_id] = (failed, None)
+                else:
+                    cls._pending[track_id] = None
+        return [found[track_id][1] for track_id in track_ids if track_id in found]
+
+    @classmethod
+    def _warm_genres(cls, tracks: List[Any]) -> None:
+        """ Fetches the genres of a whole batch with one artists request, best effort """
+        if not tracks or not Zotify.CONFIG.get_save_genres():
+            return
+        try:
+            GenreCache.get(artist[ID] for track in tracks if track for artist in track[ARTISTS])
+        except Exception as e:
+            # each track looks its genres up again while tagging
+            Printer.print(PrintChannel.WARNINGS, f'###   WARNING: COULD NOT PREFETCH ARTIST GENRES ({e})   ###')
+
+
 def get_song_info(song_id) -> Tuple[List[str], List[Any], str, str, Any, Any, Any, Any, Any, Any, int]:
     """ Retrieves metadata for downloaded songs """
-    with Loader(PrintChannel.PROGRESS_INFO, "Fetching track information..."):
-        (raw, info) = Zotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
+    (raw, track) = SongInfoCache.get(song_id)
 
-    if not TRACKS in info:
+    if track is None:
         raise ValueError(f'Invalid response from TRACKS_URL:\n{raw}')
 
     try:
         artists = []
-        for data in info[TRACKS][0][ARTISTS]:
+        for data in track[ARTISTS]:
             artists.append(data[NAME])
 
-        album_name = info[TRACKS][0][ALBUM][NAME]
-        name = info[TRACKS][0][NAME]
-        release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-        disc_number = info[TRACKS][0][DISC_NUMBER]
-        track_number = info[TRACKS][0][TRACK_NUMBER]
-        scraped_song_id = info[TRACKS][0][ID]
-        is_playable = info[TRACKS][0][IS_PLAYABLE]
-        duration_ms = info[TRACKS][0][DURATION_MS]
-
-        image = info[TRACKS][0][ALBUM][IMAGES][0]
-        for i in info[TRACKS][0][ALBUM][IMAGES]:
+        album_name = track[ALBUM][NAME]
+        name = track[NAME]
+        release_year = track[ALBUM][RELEASE_DATE].split('-')[0]
+        disc_number = track[DISC_NUMBER]
+        track_number = track[TRACK_NUMBER]
+        scraped_song_id = track[ID]
+        is_playable = track[IS_PLAYABLE]
+        duration_ms = track[DURATION_MS]
+
+        image = track[ALBUM][IMAGES][0]
+        for i in track[ALBUM][IMAGES]:
             if i[WIDTH] > image[WIDTH]:
                 image = i
         image_url = image[URL]
 
-        return artists, info[TRACKS][0][ARTISTS], album_name, name, image_url, release_year, disc_number, track_number, scraped_song_id, is_playable, duration_ms
+        return artists, track[ARTISTS], album_name, name, image_url, release_year, disc_number, track_number, scraped_song_id, is_playable, duration_ms
     except Exception as e:
         raise ValueError(f'Failed to parse TRACKS_URL response: {str(e)}\n{raw}')
 
 
-def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
+def get_song_genres(rawartists: List[Any], track_name: str) -> List[str]:
     if Zotify.CONFIG.get_save_genres():
         try:
             genres = []
+            artist_genres = GenreCache.get([data[ID] for data in rawartists])
             for data in rawartists:
-                # query artist genres via href, which will be the api url
-                with Loader(PrintChannel.PROGRESS_INFO, "Fetching artist information..."):
-                    (raw, artistInfo) = Zotify.invoke_url(f'{data[HREF]}')
-                if Zotify.CONFIG.get_all_genres() and len(artistInfo[GENRES]) > 0:
-                    for genre in artistInfo[GENRES]:
+                artist_genre = artist_genres.get(data[ID], [])
+                if Zotify.CONFIG.get_all_genres() and len(artist_genre) > 0:
+                    for genre in artist_genre:
                         genres.append(genre)
-                elif len(artistInfo[GENRES]) > 0:
-                    genres.append(artistInfo[GENRES][0])
+                elif len(artist_genre) > 0:
+                    genres.append(artist_genre[0])
 
             if len(genres) == 0:
                 Printer.print(PrintChannel.WARNINGS, '###    No Genres found for song ' + track_name)
@@ -99,7 +261,7 @@ def get_song_genres(rawartists: List[str], track_name: str) -> List[str]:
 
             return genres
         except Exception as e:
-            raise ValueError(f'Failed to parse GENRES response: {str(e)}\n{raw}')
+            raise ValueError(f'Failed to parse GENRES response: {str(e)}')
     else:
         return ['']
 
@@ -142,57 +304,84 @@ def get_song_duration(song_id: str) -> float:
     return duration
 
 
-def download_track(mode: str, track_id: str, extra_keys=None, disable_progressbar=False) -> None:
-    """ Downloads raw song audio from Spotify """
+def get_output_template(mode: str, extra_keys=None) -> str:
+    """ Returns the output template of a mode with extra_keys filled in
+
+    The track's own keys are left for get_output_path, so two work items with
+    the same track id and the same template end up at the same file.
+    """
+    output_template = str(Zotify.CONFIG.get_output(mode))
+    for k in extra_keys or {}:
+        output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
+    return output_template
+
+
+def get_output_path(output_template, track_id, artists, album_name, name, release_year, disc_number,
+                    track_number, scraped_song_id) -> PurePath:
+    """ Returns where a track is saved, filling in the rest of a template from get_output_template """
+    ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
+
+    output_template = output_template.replace("{artist}", fix_filename(artists[0]))
+    output_template = output_template.replace("{album}", fix_filename(album_name))
+    output_template = output_template.replace("{song_name}", fix_filename(name))
+    output_template = output_template.replace("{release_year}", fix_filename(release_year))
+    output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
+    output_template = output_template.replace("{track_number}", fix_filename(track_number))
+    output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
+    output_template = output_template.replace("{track_id}", fix_filename(track_id))
+    output_template = output_template.replace("{ext}", ext)
+
+    return PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+
+
+def download_track(mode: str, track_id: str, extra_keys=None, disable_progressbar=False,
+                   on_finished: Optional[Callable[[DownloadResult], None]] = None) -> DownloadResult:
+    """ Downloads raw song audio from Spotify
+
+    on_finished is called with the final result, from the transcode pool once
+    a download is converted, or before returning for anything else.
+    """
 
     if extra_keys is None:
         extra_keys = {}
+    result = DownloadResult(FAILED, track_id)
+    # whether this call writes a file other paths of the track wait for, and handed it to the transcode pool
+    writing = submitted = False
 
     prepare_download_loader = Loader(PrintChannel.PROGRESS_INFO, "Preparing download...")
     prepare_download_loader.start()
 
     try:
-        output_template = Zotify.CONFIG.get_output(mode)
+        output_template = get_output_template(mode, extra_keys)
 
         (artists, raw_artists, album_name, name, image_url, release_year, disc_number,
          track_number, scraped_song_id, is_playable, duration_ms) = get_song_info(track_id)
+        result = result._replace(track_id=scraped_song_id, artist=artists[0], album=album_name, name=name,
+                                 duration_ms=duration_ms)
 
         song_name = fix_filename(artists[0]) + ' - ' + fix_filename(name)
 
-        for k in extra_keys:
-            output_template = output_template.replace("{"+k+"}", fix_filename(extra_keys[k]))
-
         ext = EXT_MAP.get(Zotify.CONFIG.get_download_format().lower())
 
-        output_template = output_template.replace("{artist}", fix_filename(artists[0]))
-        output_template = output_template.replace("{album}", fix_filename(album_name))
-        output_template = output_template.replace("{song_name}", fix_filename(name))
-        output_template = output_template.replace("{release_year}", fix_filename(release_year))
-        output_template = output_template.replace("{disc_number}", fix_filename(disc_number))
-        output_template = output_template.replace("{track_number}", fix_filename(track_number))
-        output_template = output_template.replace("{id}", fix_filename(scraped_song_id))
-        output_template = output_template.replace("{track_id}", fix_filename(track_id))
-        output_template = output_template.replace("{ext}", ext)
-
-        filename = PurePath(Zotify.CONFIG.get_root_path()).joinpath(output_template)
+        filename = get_output_path(output_template, track_id, artists, album_name, name, release_year,
+                                   disc_number, track_number, scraped_song_id)
         filedir = PurePath(filename).parent
 
-        filename_temp = filename
+        # always written under another name and moved into place, so a file
+        # hardlinked to other paths is replaced instead of written into
         if Zotify.CONFIG.get_temp_download_dir() != '':
             filename_temp = PurePath(Zotify.CONFIG.get_temp_download_dir()).joinpath(f'zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
+        else:
+            filename_temp = filedir.joinpath(f'.zotify_{str(uuid.uuid4())}_{track_id}.{ext}')
 
-        check_name = Path(filename).is_file() and Path(filename).stat().st_size
+        dir_index = DirectoryIndex.of(filedir)
+        check_name = PurePath(filename).name in dir_index.files and Path(filename).is_file() and Path(filename).stat().st_size
         check_id = scraped_song_id in get_directory_song_ids(filedir)
         check_all_time = scraped_song_id in get_previously_downloaded()
 
-        # a song with the same name is installed
-        if not check_id and check_name:
-            c = len([file for file in Path(filedir).iterdir() if re.search(f'^{filename}_', str(file))]) + 1
-
-            fname = PurePath(PurePath(filename).name).parent
-            ext = PurePath(PurePath(filename).name).suffix
-
-            filename = PurePath(filedir).joinpath(f'{fname}_{c}{ext}')
+        # a song with the same name is installed, and a song reached twice in one run is only saved once
+        path_claim, check_repeat = dir_index.claim(filename, scraped_song_id, rename=not check_id and check_name)
+        filename = path_claim.path
 
     except Exception as e:
         Printer.print(PrintChannel.ERRORS, '###   SKIPPING SONG - FAILED TO QUERY METADATA   ###')
@@ -208,82 +397,193 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
             if not is_playable:
                 prepare_download_loader.stop()
                 Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG IS UNAVAILABLE)   ###' + "\n")
+                result = result._replace(status=SKIPPED)
             else:
-                if check_id and check_name and Zotify.CONFIG.get_skip_existing():
+                if check_repeat:
+                    prepare_download_loader.stop()
+                    Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY DOWNLOADED IN THIS RUN)   ###' + "\n")
+                    result = result._replace(status=SKIPPED, path=filename)
+
+                elif check_id and check_name and Zotify.CONFIG.get_skip_existing():
                     prepare_download_loader.stop()
                     Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY EXISTS)   ###' + "\n")
+                    result = result._replace(status=SKIPPED, path=filename)
 
                 elif check_all_time and Zotify.CONFIG.get_skip_previously_downloaded():
                     prepare_download_loader.stop()
                     Printer.print(PrintChannel.SKIPS, '\n###   SKIPPING: ' + song_name + ' (SONG ALREADY DOWNLOADED ONCE)   ###' + "\n")
+                    # the earlier download may live under another path
+                    result = result._replace(status=SKIPPED, path=filename if Path(filename).is_file() else None)
 
                 else:
                     if track_id != scraped_song_id:
                         track_id = scraped_song_id
-                    track = TrackId.from_base62(track_id)
-                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
-                    create_download_directory(filedir)
-                    total_size = stream.input_stream.size
-
-                    prepare_download_loader.stop()
-
-                    time_start = time.time()
-                    downloaded = 0
-                    with open(filename_temp, 'wb') as file, Printer.progress(
-                            desc=song_name,
-                            total=total_size,
-                            unit='B',
-                            unit_scale=True,
-                            unit_divisor=1024,
-                            disable=disable_progressbar
-                    ) as p_bar:
-                        b = 0
-                        while b < 5:
-                        #for _ in range(int(total_size / Zotify.CONFIG.get_chunk_size()) + 2):
-                            data = stream.input_stream.stream().read(Zotify.CONFIG.get_chunk_size())
-                            p_bar.update(file.write(data))
-                            downloaded += len(data)
-                            b += 1 if data == b'' else 0
-                            if Zotify.CONFIG.get_download_real_time():
-                                delta_real = time.time() - time_start
-                                delta_want = (downloaded / total_size) * (duration_ms/1000)
-                                if delta_want > delta_real:
-                                    time.sleep(delta_want - delta_real)
-
-                    time_downloaded = time.time()
-
-                    genres = get_song_genres(raw_artists, name)
-
-                    if(Zotify.CONFIG.get_download_lyrics()):
+                    variant = get_file_variant()
+                    duplicate_files = Zotify.CONFIG.get_duplicate_files()
+                    source = None
+                    if duplicate_files != DOWNLOAD:
+                        # another path of this track in the same format and quality is reused, or being written
+                        source = TrackFiles.find_or_write(scraped_song_id, variant, filename)
+                        writing = source is None
+
+                    if source is not None:
+                        create_download_directory(filedir)
+                        how = materialize_file(source, filename, duplicate_files)
+                        prepare_download_loader.stop()
+
+                        # the file is in place, record it before anything optional can fail
+                        StateDB.add_file(scraped_song_id, variant, str(filename))
+                        if Zotify.CONFIG.get_skip_previously_downloaded():
+                            add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
+                        if not check_id:
+                            add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                        result = result._replace(status=DOWNLOADED, path=filename)
+
+                        if Zotify.CONFIG.get_download_lyrics():
+                            source_lyrics = Path(str(source)[:-3] + "lrc")
+                            try:
+                                if source_lyrics.is_file():
+                                    shutil.copyfile(source_lyrics, str(filename)[:-3] + "lrc")
+                                else:
+                                    get_song_lyrics(track_id, PurePath(str(filename)[:-3] + "lrc"))
+                            except (ValueError, OSError):
+                                Printer.print(PrintChannel.SKIPS, f"###   Skipping lyrics for {song_name}: lyrics not available   ###")
                         try:
-                            get_song_lyrics(track_id, PurePath(str(filename)[:-3] + "lrc"))
-                        except ValueError:
-                            Printer.print(PrintChannel.SKIPS, f"###   Skipping lyrics for {song_name}: lyrics not available   ###")
-                    convert_audio_format(filename_temp)
-                    try:
-                        set_audio_tags(filename_temp, artists, genres, name, album_name, release_year, disc_number, track_number)
-                        set_music_thumbnail(filename_temp, image_url)
-                    except Exception:
-                        Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
-
-                    if filename_temp != filename:
-                        Path(filename_temp).rename(filename)
-
-                    time_finished = time.time()
-
-                    Printer.print(PrintChannel.DOWNLOADS, f'###   Downloaded "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" in {fmt_seconds(time_downloaded - time_start)} (plus {fmt_seconds(time_finished - time_downloaded)} converting)   ###' + "\n")
-
-                    # add song id to archive file
-                    if Zotify.CONFIG.get_skip_previously_downloaded():
-                        add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
-                    # add song id to download directory's .song_ids file
-                    if not check_id:
-                        add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
-
-                    if Zotify.CONFIG.get_bulk_wait_time():
-                        wait_time = Zotify.CONFIG.get_bulk_wait_time()
-                        Printer.print(PrintChannel.PROGRESS_INFO, f'Download successful. Waiting {wait_time} seconds.')
-                        time.sleep(wait_time)
+                            save_cover_art(filedir, ArtworkCache.get(image_url))
+                        except Exception:
+                            Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
+
+                        verb = {HARDLINK: 'Linked', REFLINK: 'Reflinked', COPY: 'Copied'}[how]
+                        Printer.print(PrintChannel.DOWNLOADS, f'###   {verb} "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" from "{source}"   ###' + "\n")
+
+                    else:
+                        track = TrackId.from_base62(track_id)
+                        stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+                        create_download_directory(filedir)
+                        # the stream starts past the header, which size still counts
+                        start = stream_start(stream.input_stream.stream())
+                        content_size = stream.input_stream.size - start
+
+                        prepare_download_loader.stop()
+
+                        # with streaming on, ffmpeg encodes the stream as it arrives and only
+                        # the final file is ever written
+                        streamed = Zotify.CONFIG.get_stream_transcode() and shutil.which('ffmpeg') is not None
+                        partial = None
+                        if streamed:
+                            sink = TranscodePipe(filename_temp, get_output_params())
+                        elif Zotify.CONFIG.get_temp_download_dir() != '':
+                            # staged so a failed or interrupted download continues where it stopped
+                            sink = partial = PartialDownload(Zotify.CONFIG.get_temp_download_dir(), scraped_song_id,
+                                                             content_size, str(Zotify.DOWNLOAD_QUALITY), key=str(filename))
+                        else:
+                            sink = open(filename_temp, 'wb')
+
+                        time_start = time.time()
+                        resumed = partial.position if partial is not None else 0
+                        downloaded = 0
+                        attempt = 0
+                        with sink as file, Printer.progress(
+                                desc=song_name,
+                                total=content_size,
+                                initial=resumed,
+                                unit='B',
+                                unit_scale=True,
+                                unit_divisor=1024,
+                                disable=disable_progressbar
+                        ) as p_bar:
+                            while True:
+                                position = resumed + downloaded
+                                try:
+                                    input_stream = stream.input_stream.stream()
+                                    if position:
+                                        input_stream.seek(start + position)
+                                    for data in ChunkedReader(input_stream, content_size, Zotify.CONFIG.get_chunk_size(), position):
+                                        if SHUTDOWN.is_set():
+                                            raise KeyboardInterrupt
+                                        p_bar.update(file.write(data))
+                                        downloaded += len(data)
+                                        if Zotify.CONFIG.get_download_real_time():
+                                            delta_real = time.time() - time_start
+                                            delta_want = (downloaded / content_size) * (duration_ms/1000)
+                                            if delta_want > delta_real:
+                                                time.sleep(delta_want - delta_real)
+                                    if partial is not None and partial.position < content_size:
+                                        raise IOError(f'stream ended after {partial.position} of {content_size} bytes')
+                                    break
+                                except Exception as e:
+                                    attempt += 1
+                                    if partial is None or attempt > Zotify.CONFIG.get_retry_attempts():
+                                        raise
+                                    Printer.print(PrintChannel.WARNINGS, f'###   RESUMING: {song_name} AT {resumed + downloaded} OF {content_size} BYTES ({e})   ###')
+                                    stream = Zotify.get_content_stream(track, Zotify.DOWNLOAD_QUALITY)
+
+                        if partial is not None:
+                            partial.complete(filename_temp)
+
+                        time_downloaded = time.time()
+
+                        def finish_download():
+                            """ Converts, tags and moves the downloaded stream into place """
+                            final = converting._replace(status=FAILED, path=None)
+                            try:
+                                genres = get_song_genres(raw_artists, name)
+
+                                if(Zotify.CONFIG.get_download_lyrics()):
+                                    try:
+                                        get_song_lyrics(track_id, PurePath(str(filename)[:-3] + "lrc"))
+                                    except ValueError:
+                                        Printer.print(PrintChannel.SKIPS, f"###   Skipping lyrics for {song_name}: lyrics not available   ###")
+                                if not streamed:
+                                    convert_audio_format(filename_temp)
+                                try:
+                                    artwork = ArtworkCache.get(image_url)
+                                    set_audio_tags(filename_temp, artists, genres, name, album_name, release_year, disc_number, track_number, artwork)
+                                    save_cover_art(filedir, artwork)
+                                except Exception:
+                                    Printer.print(PrintChannel.ERRORS, "Unable to write metadata, ensure ffmpeg is installed and added to your PATH.")
+
+                                Path(filename_temp).replace(filename)
+                                StateDB.add_file(scraped_song_id, variant, str(filename))
+
+                                time_finished = time.time()
+
+                                Printer.print(PrintChannel.DOWNLOADS, f'###   Downloaded "{song_name}" to "{Path(filename).relative_to(Zotify.CONFIG.get_root_path())}" in {fmt_seconds(time_downloaded - time_start)} (plus {fmt_seconds(time_finished - time_downloaded)} converting)   ###' + "\n")
+
+                                # add song id to archive file
+                                if Zotify.CONFIG.get_skip_previously_downloaded():
+                                    add_to_archive(scraped_song_id, PurePath(filename).name, artists[0], name)
+                                # add song id to download directory's .song_ids file
+                                if not check_id:
+                                    add_to_directory_song_ids(filedir, scraped_song_id, PurePath(filename).name, artists[0], name)
+                                final = converting._replace(status=DOWNLOADED)
+
+                            except Exception as e:
+                                Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + song_name + ' (GENERAL CONVERSION ERROR)   ###')
+                                Printer.print(PrintChannel.ERRORS, 'Track_ID: ' + str(track_id))
+                                Printer.print(PrintChannel.ERRORS, str(e) + "\n")
+                                Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
+                                for temp_file in (filename_temp, f'{filename_temp}.tmp'):
+                                    if Path(temp_file).exists():
+                                        Path(temp_file).unlink()
+                            finally:
+                                # waiting paths of this track either find the file now or download it themselves
+                                if writing:
+                                    TrackFiles.done(scraped_song_id, variant)
+                                path_claim.finish(final.status == DOWNLOADED)
+                                if on_finished is not None:
+                                    on_finished(final)
+
+                        # encode on the transcode pool while this worker moves on to the next track
+                        converting = result._replace(status=CONVERTING, path=filename)
+                        TranscodePool.submit(finish_download)
+                        submitted = True
+                        result = converting
+
+        except KeyboardInterrupt:
+            if Path(filename_temp).exists():
+                Path(filename_temp).unlink()
+            raise
 
         except Exception as e:
             Printer.print(PrintChannel.ERRORS, '###   SKIPPING: ' + song_name + ' (GENERAL DOWNLOAD ERROR)   ###')
@@ -296,31 +596,59 @@ def download_track(mode: str, track_id: str, extra_keys=None, disable_progressba
             if Path(filename_temp).exists():
                 Path(filename_temp).unlink()
 
+        finally:
+            if writing and not submitted:
+                TrackFiles.done(scraped_song_id, variant)
+            # repeats of this path waited for it, they reuse it if it is there
+            if not check_repeat and not submitted:
+                path_claim.finish(result.status != FAILED and result.path is not None)
+
     prepare_download_loader.stop()
+    if on_finished is not None and result.status != CONVERTING:
+        on_finished(result)
+    return result
 
 
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable file """
-    temp_filename = f'{PurePath(filename).parent}.tmp'
-    Path(filename).replace(temp_filename)
+def get_bitrate() -> str:
+    """ Returns the bitrate of the configured download quality, like 320k """
+    bitrates = {
+        'auto': '320k' if Zotify.check_premium() else '160k',
+        'normal': '96k',
+        'high': '160k',
+        'very_high': '320k'
+    }
+    return bitrates[Zotify.CONFIG.get_download_quality()]
+
+
+def get_file_variant() -> str:
+    """ Returns what a track file's bytes depend on besides the track, its format and bitrate """
+    return f'{Zotify.CONFIG.get_download_format().lower()}:{get_bitrate()}'
+
 
+def get_output_params() -> List[str]:
+    """ Returns the ffmpeg output options for the configured download format """
     download_format = Zotify.CONFIG.get_download_format().lower()
     file_codec = CODEC_MAP.get(download_format, 'copy')
     if file_codec != 'copy':
         bitrate = Zotify.CONFIG.get_transcode_bitrate()
-        bitrates = {
-            'auto': '320k' if Zotify.check_premium() else '160k',
-            'normal': '96k',
-            'high': '160k',
-            'very_high': '320k'
-        }
-        bitrate = bitrates[Zotify.CONFIG.get_download_quality()]
+        bitrate = get_bitrate()
     else:
         bitrate = None
 
     output_params = ['-c:a', file_codec]
     if bitrate:
         output_params += ['-b:a', bitrate]
+    return output_params
+
+
+def convert_audio_format(filename) -> None:
+    """ Converts raw audio into playable file """
+    # named after the file itself so parallel conversions in one folder don't clobber each other
+    temp_filename = f'{filename}.tmp'
+    Path(filename).replace(temp_filename)
+
+    output_params = get_output_params()
+    file_codec = output_params[1]
 
     try:
         ff_m = ffmpy.FFmpeg(
@@ -335,4 +663,5 @@ def convert_audio_format(filename) -> None:
             Path(temp_filename).unlink()
 
     except ffmpy.FFExecutableNotFoundError:
+        Path(temp_filename).replace(filename)
         Printer.print(PrintChannel.WARNINGS, f'###   SKIPPING {file_codec.upper()} CONVERSION - FFMPEG NOT FOUND   ###')
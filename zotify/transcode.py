@@ -0,0 +1,100 @@
+import os
+import subprocess
+import tempfile
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List
+
+from zotify.termoutput import Printer, PrintChannel
+from zotify.zotify import Zotify
+
+# bytes of ffmpeg's error output kept for the exception
+STDERR_TAIL = 4096
+
+
+class TranscodePipe:
+    """ File-like sink that encodes everything written to it straight into filename
+
+    with TranscodePipe(filename, ['-c:a', 'libmp3lame']) as sink:
+        sink.write(data)
+    """
+
+    def __init__(self, filename, output_params: List[str]):
+        self.filename = filename
+        # a file rather than a pipe, nobody reads a pipe before the end and a full one would block ffmpeg
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0', *output_params, str(filename)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self.stderr
+        )
+
+    def write(self, data) -> int:
+        self.process.stdin.write(data)
+        return len(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        with self.stderr:
+            if exc_type is not None:
+                self.process.kill()
+                self.process.wait()
+                return
+
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                self.stderr.seek(max(self.stderr.seek(0, os.SEEK_END) - STDERR_TAIL, 0))
+                stderr = self.stderr.read().decode('utf-8', 'replace').strip()
+                raise RuntimeError(f'ffmpeg failed to encode {self.filename}: {stderr}')
+
+
+class TranscodePool:
+    """ Runs the convert, tag and move stage of downloads on its own bounded pool
+
+    download_track hands finished streams to this stage and goes on with the
+    next track, so the network never sits idle while ffmpeg encodes. At most
+    two jobs per worker are queued, after that downloads wait for a free slot.
+    """
+    _executor: ThreadPoolExecutor = None
+    _slots: threading.BoundedSemaphore = None
+    _futures = set()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_workers(cls) -> int:
+        return Zotify.CONFIG.get_transcode_workers() or os.cpu_count() or 1
+
+    @classmethod
+    def submit(cls, func, *args, **kwargs) -> None:
+        with cls._lock:
+            if cls._executor is None:
+                workers = cls.get_workers()
+                cls._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zotify-transcode')
+                cls._slots = threading.BoundedSemaphore(workers * 2)
+
+        cls._slots.acquire()
+        future = cls._executor.submit(func, *args, **kwargs)
+        with cls._lock:
+            cls._futures.add(future)
+        future.add_done_callback(cls._done)
+
+    @classmethod
+    def join(cls) -> None:
+        """ Waits until every queued job has finished """
+        with cls._lock:
+            futures = list(cls._futures)
+        wait(futures)
+
+    @classmethod
+    def _done(cls, future) -> None:
+        cls._slots.release()
+        with cls._lock:
+            cls._futures.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            Printer.print(PrintChannel.ERRORS, '###   CONVERSION FAILED   ###')
+            Printer.print(PrintChannel.ERRORS, "".join(traceback.TracebackException.from_exception(e).format()) + "\n")
@@ -4,15 +4,17 @@ import os
 import platform
 import re
 import subprocess
+import threading
 from enum import Enum
 from pathlib import Path, PurePath
-from typing import List, Tuple
+from typing import List, Set, Tuple
 
 import music_tag
-import requests
 
 from zotify.const import ARTIST, GENRE, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, TRACKNUMBER, ARTWORK, \
     WINDOWS_SYSTEM, ALBUMARTIST
+from zotify.pool import SHUTDOWN
+from zotify.termoutput import Printer, PrintChannel
 from zotify.zotify import Zotify
 
 
@@ -21,64 +23,176 @@ class MusicFormat(str, Enum):
     OGG = 'ogg',
 
 
+class DirectoryIndex:
+    """ Per-run index of a download directory's .song_ids and file names
+
+    Each directory is listed and its .song_ids read once, later writes go
+    through the index so id and name collision checks never touch the disk.
+    """
+    _indexes = {}
+    _lock = threading.Lock()
+
+    def __init__(self, download_path):
+        self.path = Path(download_path)
+        self.song_ids = set()
+        self.files = set()
+        self.claims = {}
+        # song claiming each bare file name this run
+        self.names = {}
+        self.lock = threading.Lock()
+        self.claims_lock = threading.Lock()
+
+        self.exists = self.path.is_dir()
+        if self.exists:
+            self.files = {entry.name for entry in os.scandir(self.path)}
+            if '.song_ids' in self.files:
+                with open(self.path.joinpath('.song_ids'), 'r', encoding='utf-8') as file:
+                    self.song_ids = {line.split('\t', 1)[0].strip() for line in file}
+                self.song_ids.discard('')
+
+    @classmethod
+    def of(cls, download_path) -> 'DirectoryIndex':
+        key = str(download_path)
+        with cls._lock:
+            if key not in cls._indexes:
+                cls._indexes[key] = DirectoryIndex(download_path)
+            return cls._indexes[key]
+
+    def add_file(self, filename: str) -> None:
+        with self.lock:
+            self.files.add(filename)
+
+    def reserve_unique_name(self, filename: str) -> str:
+        """ Returns and reserves the first free name_N.ext for a name that is already taken """
+        stem = PurePath(filename).stem
+        ext = PurePath(filename).suffix
+        with self.lock:
+            c = 1
+            while f'{stem}_{c}{ext}' in self.files:
+                c += 1
+            self.files.add(f'{stem}_{c}{ext}')
+        return f'{stem}_{c}{ext}'
+
+    def claim(self, filename, song_id: str, rename: bool) -> Tuple['PathClaim', bool]:
+        """ Returns where song_id is saved as filename in this run, and whether an earlier download saved it there
+
+        rename picks a free name_N.ext when another song already took the name
+        on disk, and so does a name another song claimed earlier in this run,
+        since its file may still be converting.
+        A repeat waits until the earlier download is finished, and takes the
+        claim over if it failed. Whoever gets a new claim must finish it.
+        """
+        key = (PurePath(filename).name, song_id)
+        while True:
+            with self.claims_lock:
+                claim = self.claims.get(key)
+                if claim is None or (claim.finished.is_set() and not claim.saved):
+                    if claim is not None:
+                        filename = claim.path
+                    elif rename or self.names.get(PurePath(filename).name, song_id) != song_id:
+                        filename = PurePath(filename).parent.joinpath(self.reserve_unique_name(PurePath(filename).name))
+                    self.names[PurePath(filename).name] = song_id
+                    self.add_file(PurePath(filename).name)
+                    self.claims[key] = PathClaim(filename)
+                    return self.claims[key], False
+                if claim.finished.is_set():
+                    return claim, True
+            while not claim.finished.wait(0.5):
+                if SHUTDOWN.is_set():
+                    raise KeyboardInterrupt
+
+
+class PathClaim:
+    """ A file one download of this run is saving, see DirectoryIndex.claim """
+
+    def __init__(self, path):
+        self.path = path
+        self.saved = False
+        self.finished = threading.Event()
+
+    def finish(self, saved: bool) -> None:
+        self.saved = saved
+        self.finished.set()
+
+
 def create_download_directory(download_path: str) -> None:
     """ Create directory and add a hidden file with song ids """
+    index = DirectoryIndex.of(download_path)
+    if index.exists and '.song_ids' in index.files:
+        return
+
     Path(download_path).mkdir(parents=True, exist_ok=True)
 
     # add hidden file with song ids
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    if not Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'w', encoding='utf-8') as f:
-            pass
-
+    # append mode, a parallel download may have just written the first id
+    with open(hidden_file_path, 'a', encoding='utf-8') as f:
+        pass
+    index.exists = True
+    index.add_file('.song_ids')
 
-def get_previously_downloaded() -> List[str]:
-    """ Returns list of all time downloaded songs """
 
-    ids = []
-    archive_path = Zotify.CONFIG.get_song_archive()
+class SongArchive:
+    """ In-memory index of the all time song archive
 
-    if Path(archive_path).exists():
-        with open(archive_path, 'r', encoding='utf-8') as f:
-            ids = [line.strip().split('\t')[0] for line in f.readlines()]
-
-    return ids
+    The archive file is read once per run, after that lookups are set
+    membership tests and add_to_archive keeps the index and the file in sync.
+    """
+    _ids = None
+    _path = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_ids(cls) -> Set[str]:
+        if cls._ids is None:
+            with cls._lock:
+                if cls._ids is None:
+                    archive_path = Zotify.CONFIG.get_song_archive()
+                    ids = set()
+                    if Path(archive_path).exists():
+                        with open(archive_path, 'r', encoding='utf-8') as f:
+                            ids = {line.split('\t', 1)[0].strip() for line in f}
+                        ids.discard('')
+                    cls._path = archive_path
+                    cls._ids = ids
+        return cls._ids
+
+    @classmethod
+    def add(cls, song_id: str, filename: str, author_name: str, song_name: str) -> None:
+        ids = cls.get_ids()
+        with cls._lock:
+            with open(cls._path, 'a', encoding='utf-8') as file:
+                file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+            ids.add(song_id)
+
+
+def get_previously_downloaded() -> Set[str]:
+    """ Returns set of all time downloaded songs """
+    return SongArchive.get_ids()
 
 
 def add_to_archive(song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Adds song id to all time installed songs archive """
-
-    archive_path = Zotify.CONFIG.get_song_archive()
-
-    if Path(archive_path).exists():
-        with open(archive_path, 'a', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
-    else:
-        with open(archive_path, 'w', encoding='utf-8') as file:
-            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    SongArchive.add(song_id, filename, author_name, song_name)
 
 
-def get_directory_song_ids(download_path: str) -> List[str]:
+def get_directory_song_ids(download_path: str) -> Set[str]:
     """ Gets song ids of songs in directory """
-
-    song_ids = []
-
-    hidden_file_path = PurePath(download_path).joinpath('.song_ids')
-    if Path(hidden_file_path).is_file():
-        with open(hidden_file_path, 'r', encoding='utf-8') as file:
-            song_ids.extend([line.strip().split('\t')[0] for line in file.readlines()])
-
-    return song_ids
+    return DirectoryIndex.of(download_path).song_ids
 
 
 def add_to_directory_song_ids(download_path: str, song_id: str, filename: str, author_name: str, song_name: str) -> None:
     """ Appends song_id to .song_ids file in directory """
 
+    index = DirectoryIndex.of(download_path)
     hidden_file_path = PurePath(download_path).joinpath('.song_ids')
     # not checking if file exists because we need an exception
     # to be raised if something is wrong
-    with open(hidden_file_path, 'a', encoding='utf-8') as file:
-        file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+    with index.lock:
+        with open(hidden_file_path, 'a', encoding='utf-8') as file:
+            file.write(f'{song_id}\t{datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\t{author_name}\t{song_name}\t{filename}\n')
+        index.song_ids.add(song_id)
+        index.files.add(filename)
 
 
 def get_downloaded_song_duration(filename: str) -> float:
@@ -126,8 +240,8 @@ def clear() -> None:
         os.system('clear')
 
 
-def set_audio_tags(filename, artists, genres, name, album_name, release_year, disc_number, track_number) -> None:
-    """ sets music_tag metadata """
+def set_audio_tags(filename, artists, genres, name, album_name, release_year, disc_number, track_number, artwork=None) -> None:
+    """ sets music_tag metadata, and the cover artwork if given, in a single load/save """
     tags = music_tag.load_file(filename)
     tags[ALBUMARTIST] = artists[0]
     tags[ARTIST] = artists[0]
@@ -137,6 +251,8 @@ def set_audio_tags(filename, artists, genres, name, album_name, release_year, di
     tags[YEAR] = release_year
     tags[DISCNUMBER] = disc_number
     tags[TRACKNUMBER] = track_number
+    if artwork is not None:
+        tags[ARTWORK] = artwork
     tags.save()
 
 
@@ -145,24 +261,17 @@ def conv_artist_format(artists) -> str:
     return ', '.join(artists)
 
 
-def set_music_thumbnail(filename, image_url) -> None:
-    """ Downloads cover artwork, saves it as a JPEG, and embeds it into the music file's metadata """
+def save_cover_art(download_path, image: bytes) -> None:
+    """ Saves cover artwork as cover.jpg in the directory, unless it already has one """
+    index = DirectoryIndex.of(download_path)
+    if 'cover.jpg' in index.files:
+        return
 
-    # Determine the new image filename with .jpg extension
-    image_filename = Path(filename).parent.joinpath('cover.jpg')
-
-    # Check if the image file already exists
-    if not image_filename.exists():
-        img = requests.get(image_url).content
-        with open(image_filename, 'wb') as img_file:
-            img_file.write(img)
-        print(f"Image saved as {image_filename}")
-
-    # Add the image to the music file's metadata
-    tags = music_tag.load_file(filename)
-    with open(image_filename, 'rb') as img_file:
-        tags['artwork'] = img_file.read()
-    tags.save()
+    image_filename = Path(download_path).joinpath('cover.jpg')
+    with open(image_filename, 'wb') as img_file:
+        img_file.write(image)
+    index.add_file('cover.jpg')
+    Printer.print(PrintChannel.PROGRESS_INFO, f"Image saved as {image_filename}")
 
 
 def regex_input_for_urls(search_input) -> Tuple[str, str, str, str, str, str]:
@@ -273,6 +382,14 @@ def fix_filename(name):
     return re.sub(r'[/\\:|<>"?*\0-\x1f]|^(AUX|COM[1-9]|CON|LPT[1-9]|NUL|PRN)(?![^.])|^\s|[\s.]$', "_", str(name), flags=re.IGNORECASE)
 
 
+def fmt_bytes(size: float) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+    return f'{size:.1f} TiB'
+
+
 def fmt_seconds(secs: float) -> str:
     val = math.floor(secs)
 
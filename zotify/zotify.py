@@ -1,24 +1,39 @@
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Iterator, Optional
 from pwinput import pwinput
 import time
 import requests
 from librespot.audio.decoders import VorbisOnlyAudioQuality
 from librespot.core import Session
 
-from zotify.const import TYPE, \
+from zotify.const import TYPE, ITEMS, TOTAL, \
     PREMIUM, USER_READ_EMAIL, OFFSET, LIMIT, \
     PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
 from zotify.config import Config
+from zotify.http_client import HttpClient, CircuitBreaker, Pacer, backoff_delay, retry_after, RATE_LIMIT_RETRIES
+from zotify.response_cache import ResponseCache
+from zotify.token_cache import TokenCache
+
+SCOPES = (USER_READ_EMAIL, PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ)
+# pages of a paginated endpoint fetched at the same time
+PAGE_FAN_OUT = 4
+
 
 class Zotify:    
     SESSION: Session = None
     DOWNLOAD_QUALITY = None
+    # --plan, list what would be downloaded instead of downloading it
+    DRY_RUN = False
     CONFIG: Config = Config()
+    TOKENS: TokenCache = None
 
     def __init__(self, args):
         Zotify.CONFIG.load(args)
         Zotify.login(args)
+        Zotify.TOKENS = TokenCache(lambda *scopes: Zotify.SESSION.tokens().get_token(*scopes), Zotify.expire_token)
 
     @classmethod
     def login(cls, args):
@@ -50,13 +65,26 @@ class Zotify:
 
     @classmethod
     def get_content_stream(cls, content_id, quality):
-        return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        Pacer.acquire()
+        start = time.monotonic()
+        try:
+            stream = cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality), False, None)
+        except Exception:
+            Pacer.record(True, time.monotonic() - start)
+            raise
+        Pacer.record(False, time.monotonic() - start)
+        return stream
+
+    @classmethod
+    def expire_token(cls, *scopes) -> None:
+        """ Makes the session mint a new token, it otherwise returns a rejected one until it expires """
+        token = cls.SESSION.tokens().find_token_with_all_scopes(list(scopes))
+        if token is not None:
+            token.expires_in = 0
 
     @classmethod
     def __get_auth_token(cls):
-        return cls.SESSION.tokens().get_token(
-            USER_READ_EMAIL, PLAYLIST_READ_PRIVATE, USER_LIBRARY_READ, USER_FOLLOW_READ
-        ).access_token
+        return cls.TOKENS.get(*SCOPES)
 
     @classmethod
     def get_auth_header(cls):
@@ -67,42 +95,137 @@ class Zotify:
             'app-platform': 'WebPlayer'
         }
 
-    @classmethod
-    def get_auth_header_and_params(cls, limit, offset):
-        return {
-            'Authorization': f'Bearer {cls.__get_auth_token()}',
-            'Accept-Language': f'{cls.CONFIG.get_language()}',
-            'Accept': 'application/json',
-            'app-platform': 'WebPlayer'
-        }, {LIMIT: limit, OFFSET: offset}
-
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
-        headers, params = cls.get_auth_header_and_params(limit=limit, offset=offset)
+        # headers are built per attempt by invoke_api, so a refreshed token is picked up on retries
+        params = {LIMIT: limit, OFFSET: offset}
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        return cls.invoke_api(url, params=params)[1]
 
     @classmethod
-    def invoke_url(cls, url, tryCount=0):
+    def invoke_url_paginated(cls, url, limit, first_page=None, **kwargs) -> Iterator[Any]:
+        """ Yields every item of a paginated endpoint in order
+
+        The first page reports the total, the remaining offsets are then
+        fetched PAGE_FAN_OUT pages at a time. first_page may be passed in when
+        it already came embedded in another response.
+        """
+        def get_page(offset):
+            page = cls.invoke_url_with_params(url, limit=limit, offset=offset, **kwargs)
+            if ITEMS not in page:
+                raise ValueError(f'Invalid response from {url} at offset {offset}:\n{page}')
+            return page
+
+        page = first_page if first_page is not None else get_page(0)
+        yield from page[ITEMS]
+
+        total = page.get(TOTAL)
+        if total is None:
+            # no total reported, walk the pages until a short one
+            offset = 0
+            while len(page[ITEMS]) == limit:
+                offset += limit
+                page = get_page(offset)
+                yield from page[ITEMS]
+            return
+
+        with ThreadPoolExecutor(max_workers=PAGE_FAN_OUT, thread_name_prefix='zotify-pages') as executor:
+            pending = deque()
+            for offset in range(limit, total, limit):
+                pending.append(executor.submit(get_page, offset))
+                if len(pending) >= PAGE_FAN_OUT:
+                    yield from pending.popleft().result()[ITEMS]
+            while pending:
+                yield from pending.popleft().result()[ITEMS]
+
+    @classmethod
+    def invoke_url(cls, url):
+        return cls.invoke_api(url)
+
+    @classmethod
+    def get_cache_key(cls, url, params=None) -> Optional[str]:
+        """ Returns the ResponseCache key of a request made by this account """
+        return ResponseCache.get_key(url, params, cls.SESSION.username())
+
+    @classmethod
+    def invoke_api(cls, url, params=None):
+        """ GETs a Web API url, retrying throttled and failed requests, and returns its text and json
+
+        Metadata responses go through ResponseCache, fresh ones are served
+        without a request and expired ones are revalidated by ETag.
+        """
         # we need to import that here, otherwise we will get circular imports!
         from zotify.termoutput import Printer, PrintChannel
-        headers = cls.get_auth_header()
-        response = requests.get(url, headers=headers)
-        responsetext = response.text
-        try:
-            responsejson = response.json()
-        except json.decoder.JSONDecodeError:
-            responsejson = {"error": {"status": "unknown", "message": "received an empty response"}}
+        cache_key = cls.get_cache_key(url, params)
+        cached = ResponseCache.get(cache_key) if cache_key is not None else None
+        if cached is not None and cached.fresh:
+            return cached.text, json.loads(cached.text)
 
-        if not responsejson or 'error' in responsejson:
-            if tryCount < (cls.CONFIG.get_retry_attempts() - 1):
-                Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {tryCount + 1}) ({responsejson['error']['status']}): {responsejson['error']['message']}")
-                time.sleep(5)
-                return cls.invoke_url(url, tryCount + 1)
+        attempts = max(cls.CONFIG.get_retry_attempts(), 1)
+        failures = 0
+        throttled = 0
+        reauthenticated = False
 
-            Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({responsejson['error']['status']}): {responsejson['error']['message']}")
+        while True:
+            CircuitBreaker.wait()
+            Pacer.acquire()
+            start = time.monotonic()
+            headers = cls.get_auth_header()
+            if cached is not None and cached.etag:
+                headers['If-None-Match'] = cached.etag
+            try:
+                response = HttpClient.get(url, headers=headers, params=params)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                Pacer.record(True, time.monotonic() - start)
+                failures += 1
+                if failures >= attempts:
+                    raise
+                delay = backoff_delay(failures)
+                Printer.print(PrintChannel.WARNINGS, f"Spotify API connection error (try {failures}): {e}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            Pacer.record(response.status_code == 429, time.monotonic() - start)
+
+            if response.status_code == 304 and cached is not None:
+                ResponseCache.refresh(cache_key)
+                return cached.text, json.loads(cached.text)
 
-        return responsetext, responsejson
+            try:
+                responsejson = response.json()
+            except json.decoder.JSONDecodeError:
+                responsejson = None
+            # server errors and empty 200s are worth another try, other errors are not
+            transient = response.status_code >= 500 or (response.status_code == 200 and not responsejson)
+            if not responsejson:
+                responsejson = {"error": {"status": response.status_code, "message": "received an empty response"}}
+
+            if response.status_code == 429 and throttled < RATE_LIMIT_RETRIES:
+                # everyone pauses, not just this thread
+                throttled += 1
+                delay = retry_after(response, throttled)
+                CircuitBreaker.trip(delay)
+                Printer.print(PrintChannel.WARNINGS, f"Spotify API rate limit hit, pausing all requests for {delay:.1f}s")
+                continue
+
+            if response.status_code == 401 and not reauthenticated:
+                reauthenticated = True
+                cls.TOKENS.invalidate(*SCOPES)
+                continue
+
+            if 'error' in responsejson and transient and failures + 1 < attempts:
+                failures += 1
+                delay = backoff_delay(failures)
+                Printer.print(PrintChannel.WARNINGS, f"Spotify API Error (try {failures}) ({responsejson['error']['status']}): {responsejson['error']['message']}")
+                time.sleep(delay)
+                continue
+
+            if 'error' in responsejson:
+                Printer.print(PrintChannel.API_ERRORS, f"Spotify API Error ({responsejson['error']['status']}): {responsejson['error']['message']}")
+            elif cache_key is not None and response.status_code == 200:
+                ResponseCache.put(cache_key, response.text, response.headers.get('ETag'))
+
+            return response.text, responsejson
 
     @classmethod
     def check_premium(cls) -> bool: